@@ -5,7 +5,11 @@ from types import MethodType
 from tanto.track import *
 from tanto.tanto_utility import *
 from tanto.clip import *
+from tanto.render import *
+from tanto.smartrender import *
 from tanto.definitions import *
+from tanto.jobs import *
+from tanto.playback import Region, maxRegionLength
 import inspect
 import pygame_textinput
 
@@ -140,8 +144,10 @@ def printDebug(self):
 
 
 def quit(self):
-    if self.isPlaying():
-        self.playPause()
+    self.player.close()
+
+    # render workers clean up after themselves when they see this
+    self.jobs.shutdown()
 
     self.storeTrackVars()
     self.running = False
@@ -181,7 +187,7 @@ def interactiveSetMark(self, pos=None):
     if clip is None:
         return "No clip!"
     if not(pos):
-        pos = getSeekPos(clip)
+        pos = self.playPosition(clip)
     setMark(clip, pos)
     return "Mark set at " + toTimecode(getMark(clip))
 
@@ -213,7 +219,7 @@ def whereMark(self):
         return "No clip!"
 
     mark= getMark(clip)
-    seek = getSeekPos(clip)
+    seek = self.playPosition(clip)
     return "seek at " + toTimecode(seek) + ", mark at " + toTimecode(mark)
 
 
@@ -253,36 +259,124 @@ def bisect(self, inPlace=False):
     if mark == 0 or mark >= clip.end:
         return "Nonsense mark position, nothing cut."
 
-    # new: if clip is a simple file, we want to use ffmpeg to cut to avoid reencoding and quality loss
-    if isFileClip(clip):
-        # this can take a moment
-        self.tts.speak("Cutting clip...")
-        a = ffmpeg_subclip(clip, 0, mark)
-        b = ffmpeg_subclip(clip, mark)        
-    else:
-        a = clip.subclip(0, mark)
-        b = clip.subclip(mark)
-    resetClipPositions(a)
-    resetClipPositions(b)
-
     track = self.getCurrentTrack()
+    def insert(a, b, snapped=None):
+        newTrack = self.replaceClip(track, clip, [a, b], inPlace=inPlace)
+        if newTrack is None:
+            return "The clip was changed or removed while cutting it. Cut discarded."
+        w = "Ok. "
+        if snapped is not None:
+            w += "cut at " + showMark(snapped) + " (nearest keyframe). "
+        if not(inPlace):
+            w += "cut clip onto "
+            w += "new track "
+            return w + newTrack.getName()
+
+        # in place
+        return w + "bisected clip in track " + track.getName()
+
+    # new: if clip is cut from files, we want to use ffmpeg to cut to avoid reencoding and quality loss
+    if not(canSmartRender(getEditList(clip))) and not(isUnmodifiedFileClip(clip)):
+        # nothing is rendered, so this is instant
+        return insert(editSubclip(clip, 0, mark), editSubclip(clip, mark))
+
+    def cut():
+        if isUnmodifiedFileClip(clip):
+            # stream copy can only cut on keyframes, but nothing is reencoded and only the part that is cut is read. The second half decides where the cut really is, and the first one ends there
+            (b, cut, _) = ffmpeg_subclip(clip, mark)
+            if (cut <= 0) or (cut >= clip.duration):
+                discardTempClip(b)
+                return (None, None, cut)
+            (a, _, _) = ffmpeg_subclip(clip, 0, cut)
+            return (a, b, cut if abs(cut - mark) > 0.001 else None)
+        if canSmartRender(getEditList(clip)):
+            # an edited clip. frame accurate, and only the frames between the cut and the next keyframe are reencoded
+            (a, b) = (smartSubclip(clip, 0, mark, audio_bitrate=track.audio_bitrate), smartSubclip(clip, mark, audio_bitrate=track.audio_bitrate))
+            if (a is not None) and (b is not None):
+                return (a, b, None)
+        return (editSubclip(clip, 0, mark), editSubclip(clip, mark), None)
+
+    def done(result):
+        (a, b, snapped) = result
+        if a is None:
+            return "Nearest keyframe is at " + showMark(snapped) + ", nothing cut."
+        return insert(a, b, snapped)
+
+    self.startJob("cutting a clip of " + track.getName(), cut, done, priority=PRIORITY_HIGH)
+    return "Cutting clip..."
+
+def replaceClip(self, track, clip, clips, inPlace=False):
+    # puts clips where clip is on track, or on a new clone of track. Returns the track they ended up on, or None if clip isn't on track anymore, since the user may have moved on while we were cutting
+    positions = [i for i in range(len(track.data)) if track.data[i] is clip]
+    if positions == []:
+        return None
+    for c in clips:
+        resetClipPositions(c)
+
     if inPlace:
         newTrack = track
+        newTrack.index = positions[0]
     else:
+        index = track.index
+        track.index = positions[0]
         newTrack = self.makeCloneTrack(track)
+        track.index = index
         newTrack.file = None
 
-    newTrack.insertClip(a)
-    newTrack.insertClip(b)
+    for c in clips:
+        newTrack.insertClip(c)
     newTrack.remove()
     if not(inPlace):
         self.appendTrack(newTrack)
-        w = "Ok. cut clip onto "
-        w += "new track "
-        return w + newTrack.getName()
+    return newTrack
+
+def splitAtSilences(self):
+    # cuts the current clip at every pause, onto a new track
+    (clip, overview) = self.currentOverview()
+    if clip is None:
+        return overview
+    track = self.getCurrentTrack()
+
+    def split(level, minLength):
+        # in the middle of each pause, so that both pieces keep a bit of it. Pauses at the very start and end don't separate anything
+        cuts = [(a + b) / 2 for (a, b) in overview.silences(level, minLength) if (a > 0) and (b < clip.duration)]
+        if cuts == []:
+            return "No pauses found, nothing split."
+
+        def done(pieces):
+            newTrack = self.replaceClip(track, clip, [piece for (piece, start, end) in pieces])
+            if newTrack is None:
+                return "The clip was changed or removed while splitting it. Split discarded."
+            return "Ok. Split clip into " + str(len(pieces)) + " clips onto new track " + newTrack.getName()
+
+        if not(isUnmodifiedFileClip(clip)):
+            # nothing is rendered, so this is instant
+            bounds = [0] + cuts + [clip.duration]
+            return done([(editSubclip(clip, a, b), a, b) for (a, b) in zip(bounds, bounds[1:])])
+        # one run of ffmpeg for all pieces, without reencoding
+        self.startJob("splitting a clip of " + track.getName(), lambda: ffmpeg_split(clip, cuts), done, priority=PRIORITY_HIGH)
+        return "Splitting clip at " + str(len(cuts)) + " pauses..."
+
+    def contLength(level):
+        def cont(n):
+            if n <= 0:
+                self.tts.speak("Please enter a positive, non-zero duration.")
+                return False
+            self.cancelTextMode()
+            self.tts.speak(split(level, n))
+            return True
+        return cont
 
-    # in place
-    return "Ok. bisected clip in track " + track.getName()
+    def contLevel(n):
+        # nobody types the minus
+        level = -abs(n)
+        self.tts.speak("Please enter the minimum length of a pause in seconds.")
+        self.enableTextMode(self.makeFloatHandler(contLength(level)), default=minSilence)
+        # returning True would clear the input, and with it the default we just put there
+        return False
+
+    self.enableTextMode(self.makeFloatHandler(contLevel), default=silenceLevel)
+    return "Please enter the level below which sound counts as silence, in decibels. Enter to confirm, escape to cancel."
 
 def createLinkTrack(self):
     clip = self.getCurrentClip()
@@ -333,6 +427,7 @@ def switchHead(self):
     self.currentTrack = headIndex
     self.currentWorkspace = headWorkspace
     self.head = prev
+    self.warmNeighbours()
     if self.head.index is not None:
         w = "to " + self.head.strIndex() + " in"
     else:
@@ -431,10 +526,9 @@ def cutClip(self, copy=False):
 
         return "Cut clip."
 
-    if isAudioClip(clip):
-        newClip = CompositeAudioClip([before, after.with_start(before.end)])
-    else:
-        newClip = CompositeVideoClip([before, after.with_start(before.end)])
+    # no composite here, we just drop the cut part from the clip's edit list
+    (mark, pos) = (getMark(clip), getSeekPos(clip))
+    newClip = makeEditListClip(editListCut(getEditList(clip), min(mark, pos), max(mark, pos)))
 
     track.remove()
     track.insertClip(newClip)
@@ -631,16 +725,24 @@ def mergeTrack2(self, fade=False):
             return False
 
         sourceTrack.fadeDuration = p
-        destinationTrack.insertClip(sourceTrack.recConcatenate(self.findChildren, fade=fade))
         self.cancelTextMode()
-        self.tts.speak("Merged clips onto track " + destinationTrack.getName() + "with " + str(p) + " fade duration.")
+        self.startJob("merging " + sourceTrack.getName(), merge, mkDone(" with " + str(p) + " fade duration."), priority=PRIORITY_LOW)
+        self.tts.speak("Merging clips onto track " + destinationTrack.getName() + "...")
         return True
 
+    # merges of files are rendered right away, so we do it in the background
+    merge = lambda: sourceTrack.recConcatenate(self.findChildren, fade=fade, cache=self.renderCache)
+    def mkDone(w=""):
+        def done(clip):
+            destinationTrack.insertClip(clip)
+            return "Merged clips onto track " + destinationTrack.getName() + w
+        return done
+
     if fade:    
         self.enableTextMode(self.makeFloatHandler(cont))
         return "Please specify the fade duration as a floating point number."
-    destinationTrack.insertClip(sourceTrack.recConcatenate(self.findChildren, fade=fade))
-    return "Merged clips onto track " + destinationTrack.getName()
+    self.startJob("merging " + sourceTrack.getName(), merge, mkDone(), priority=PRIORITY_LOW)
+    return "Merging clips onto track " + destinationTrack.getName() + "..."
 
 
 def saveTrack(self):
@@ -648,7 +750,22 @@ def saveTrack(self):
     if track is None:
         return "Cannot save. No track to save."
 
-    track.save(self.projectdir)
+    # the job renders the clips as they are now, and leaves the track itself to the main thread, where it may be edited in the meantime
+    clips = list(track.data)
+    work = lambda: track.render(self.projectdir, clips, workers=self.renderWorkers, cache=self.renderCache)
+    def done(result):
+        track.markSaved(self.projectdir)
+        return "Saved track " + track.getName()
+    self.startJob("saving track " + track.getName(), work, done, priority=PRIORITY_LOW)
+    return "Saving track " + track.getName() + "..."
+
+
+def toggleRenderProfile(self):
+    if getRenderProfile() == "draft":
+        setRenderProfile("final")
+        return "Rendering in final quality."
+    setRenderProfile("draft")
+    return "Rendering drafts. Saved clips and merges will be low quality."
 
 
 def saveClip(self):
@@ -669,8 +786,27 @@ def saveClip(self):
         print("Warning in saveClip: clip has no fps set. Choosing default of " + str(global_fps))
         clip = clip.with_fps(global_fps)
         
-    clip.write_videofile(name+extension, codec="libx264")
-    return "Ok. Wrote file " + name+extension
+    def work():
+        expectProgress(clip.duration)
+        writeClipSliced(clip, name+extension, workers=self.renderWorkers)
+    self.startJob("writing file " + name+extension, work, lambda result: "Ok. Wrote file " + name+extension, priority=PRIORITY_LOW)
+    return "Writing file " + name+extension + "..."
+
+
+def cancelJob(self):
+    # cancels the job started last, as that's usually the one you regret
+    jobs = [job for job in self.jobs.active() if not(job.progress.isCancelled())]
+    if jobs == []:
+        return "Nothing to cancel."
+    jobs[-1].cancel()
+    return "Cancelling " + jobs[-1].name + "..."
+
+def listJobs(self):
+    jobs = self.jobs.active()
+    if jobs == []:
+        return "No jobs running."
+    w = "1 job. " if len(jobs) == 1 else str(len(jobs)) + " jobs. "
+    return w + " ".join([job.describe() for job in jobs])
 
 
 
@@ -692,21 +828,15 @@ def changeVolume(self, step):
 
     mark = getMark(clip)
     if mark == 0:
-        self.setCurrentClip(clip.multiply_volume(factor))
+        newClip = makeEditListClip(editListGain(getEditList(clip), 0, clip.duration, factor))
+        setSeekPos(newClip, getSeekPos(clip))
+        self.setCurrentClip(newClip)
         return "Ok. Changed volume by " + str(step)
 
-    (preclip, sclip, afterclip) = self.getCurrentTrisection()
-    sclip = sclip.multiply_volume(factor)
-    tmp = Track()
-    tmp.insertClip(preclip)
-    tmp.insertClip(sclip)
-    tmp.insertClip(afterclip)
-    newClip = tmp.recConcatenate()
-    if newClip is None:
-        return "Oops. Couldn't change volume due to unknown error."
-    setSeekPos(newClip, getSeekPos(clip))
+    pos = getSeekPos(clip)
+    newClip = makeEditListClip(editListGain(getEditList(clip), min(mark, pos), max(mark, pos), factor))
+    setSeekPos(newClip, pos)
     setMark(newClip, mark)
-    #FIXME: this sometimes introduces an audioble clicking noise or other artefacts. not sure why
     self.setCurrentClip(newClip)
     return "Ok, changed volume of clip section by " + str(step)
 
@@ -740,7 +870,10 @@ def setVolume(self):
             self.tts.speak("Can't set volume to negative number. Please specify a positive decimal number, like 0.2 or 3.1")
             return False
 
-        self.setCurrentClip(clip.multiply_volume(p))
+        newClip = makeEditListClip(editListGain(getEditList(clip), 0, clip.duration, p))
+        setSeekPos(newClip, getSeekPos(clip))
+        setMark(newClip, getMark(clip))
+        self.setCurrentClip(newClip)
         self.cancelTextMode()
         self.tts.speak("Ok. scaled volume to " + str(p) + " times its original value.")
         return True
@@ -750,6 +883,50 @@ def setVolume(self):
 
 
 
+def normalizeTrack(self):
+    track = self.getCurrentTrack()
+    if track is None:
+        return "Cannot normalize: No track selected."
+
+    if track.isLocked():
+        return "Cannot normalize: Track is locked."
+
+    clips = [clip for clip in track.data if getAudioClip(clip) is not None]
+    if clips == []:
+        return "Cannot normalize: No clips with sound on this track."
+
+    def normalize(target):
+        def done(loudness):
+            if track.isLocked():
+                return "Track " + track.getName() + " was locked while measuring it. Nothing changed."
+            n = 0
+            for (clip, l) in zip(clips, loudness):
+                positions = [i for i in range(len(track.data)) if track.data[i] is clip]
+                # silent clips stay as they are, and so do clips that were changed in the meantime
+                if (l is None) or (positions == []):
+                    continue
+                # one gain per segment, however often the clip is normalized
+                newClip = makeEditListClip(editListGain(getEditList(clip), 0, clip.duration, normalizeGain(l, target)))
+                setSeekPos(newClip, getSeekPos(clip))
+                setMark(newClip, getMark(clip))
+                track.data[positions[0]] = newClip
+                n += 1
+            return "Ok. Normalized " + str(n) + " of " + str(len(clips)) + " clips on track " + track.getName() + " to " + str(target) + " LUFS."
+
+        self.startJob("measuring the loudness of " + track.getName(), lambda: analyseLoudness(clips), done, priority=PRIORITY_HIGH)
+        return "Measuring loudness of " + str(len(clips)) + " clips..."
+
+    def cont(n):
+        # nobody types the minus
+        self.cancelTextMode()
+        self.tts.speak(normalize(-abs(n)))
+        return True
+
+    self.enableTextMode(self.makeFloatHandler(cont), default=targetLoudness)
+    return "Please enter the loudness to normalize all clips of the track to, in LUFS. Enter to confirm, escape to cancel."
+
+
+
 def createVoiceOver(self, file=False):
     # enter a text and it is spoken and mixed into the current clip, at the mark position, while quieting the clip it is mixed into
     # file = true means you enter a name of a text file instead
@@ -788,9 +965,9 @@ def createVoiceOver2(self):
     self.createLinkTrack()
     link = self.getCurrentTrack()
     def cont():
-        self.setParentAudioFactor(self.quietFactor)
-        self.tts.speak("Created voice over track " + link.getName() + " with audio factor " + str(self.quietFactor) + ". Merge the parent to see the result.")
-        return True
+        # the voice arrives in the background, by which time the user may have moved on to another track
+        link.setParentAudioFactor(self.quietFactor)
+        return "Created voice over track " + link.getName() + " with audio factor " + str(self.quietFactor) + ". Merge the parent to see the result."
 
     return self.createVoiceClip(cont=cont)
 
@@ -925,12 +1102,17 @@ def createVoiceClip(self, cont=None):
         return "Cannot create voice message: Track is locked."
 
         
-    def handleVoiceMessage(w):
-        clip = makeVoiceClip(w)
+    def done(clip):
+        if clip is None:
+            return "Could not create voice message. Is a speech synthesizer installed?"
         track.insertClip(clip)
-        self.cancelTextMode()
         if cont:
             return cont()
+        return "Inserted voice message into " + track.getName()
+
+    def handleVoiceMessage(w):
+        self.cancelTextMode()
+        self.startJob("speaking a voice message", lambda: makeVoiceClip(w), done, priority=PRIORITY_HIGH)
         return True #delete text
 
     self.enableTextMode(handleVoiceMessage)
@@ -1089,6 +1271,7 @@ def shiftFocus(self, pos):
             self.currentTrack = len(self.tracks) - 1
         else:
             self.currentTrack = 0
+        self.warmNeighbours()
         return self.getCurrentTrack().getDisplayName()
 
 
@@ -1102,6 +1285,7 @@ def shiftFocus(self, pos):
         new = self.currentTrack+y
         new = max(0, new)
         self.currentTrack = min(len(self.tracks)-1, new)
+        self.warmNeighbours()
         return  self.tracks[self.currentTrack].getDisplayName()
 
 
@@ -1113,8 +1297,20 @@ def shiftFocus(self, pos):
         track.right()
     elif x < 0:
         track.left()
+    self.warmNeighbours()
     return track.strIndex()
 
+def warmNeighbours(self):
+    # reads the start of what is likely to be played next into memory, in the background: the selected clip, the ones either side of it and the clip at the head, each from its seek position
+    track = self.getCurrentTrack()
+    clips = []
+    if (track is not None) and (track.index is not None):
+        clips += [track.data[i] for i in [track.index, track.index+1, track.index-1] if 0 <= i < len(track.data)]
+    if (self.head is not None) and (self.head is not track):
+        clips.append(self.head.get())
+    wishes = [(getAudioClip(clip), getSeekPos(clip)) for clip in clips if clip is not None]
+    self.player.warmUp([(audio, t) for (audio, t) in wishes if audio is not None])
+
 def whereAmI(self):
     track = self.getCurrentTrack()
     if track is None:
@@ -1129,7 +1325,7 @@ def whereAmI(self):
     clip = self.getCurrentClip()
     if clip is None:
         return w
-    w += " at position " + toTimecode(getSeekPos(clip))
+    w += " at position " + toTimecode(self.playPosition(clip))
     if isAudioClip(clip):
         w += " *audio*"
     if isVideoClip(clip):
@@ -1164,7 +1360,7 @@ def seekRelative(self, tstep):
     if clip is None:
         return "No clip!"
 
-    t = getSeekPos(clip)
+    t = self.playPosition(clip)
     return self.seek(t+tstep) # FIXME: this won't work for non-second time signatures
 
 def seek(self, t):
@@ -1178,28 +1374,125 @@ def seek(self, t):
         clip.seekpos = clip.end
 
     if self.isPlaying():
-        self.playPause()
-        time.sleep(0.1)
-        self.playPause()
+        # jump right there, without stopping
+        start = self.trackPlaybackStart(clip)
+        if start is not None:
+            # the whole track keeps playing
+            self.player.seek(start + clip.seekpos)
+            return ""
+        audio = getAudioClip(clip)
+        if audio is None:
+            return ""
+        self.player.seek(clip.seekpos, audio)
         return "" # don't interrupt playback
     return showMark(t)
 
+def currentOverview(self):
+    # (clip, overview) of the selected clip, or (None, message) if there is nothing to navigate by (yet)
+    clip = self.getCurrentClip()
+    if clip is None:
+        return (None, "No clip!")
+    if (clip if isAudioClip(clip) else clip.audio) is None:
+        return (None, "This clip has no sound.")
+    overview = clipOverview(clip)
+    if overview is None:
+        return (None, "Still listening to this clip. Try again in a moment.")
+    return (clip, overview)
+
+def seekSilence(self, direction=1):
+    (clip, overview) = self.currentOverview()
+    if clip is None:
+        return overview
+
+    t = self.playPosition(clip)
+    pause = overview.nextSilence(t) if direction > 0 else overview.previousSilence(t)
+    if pause is None:
+        return "No more pauses " + ("after" if direction > 0 else "before") + " " + showMark(t) + "."
+    (start, end) = pause
+    w = self.seek(start)
+    if w == "":
+        # playing
+        return w
+    return w + ", pause of " + showMark(end - start)
+
+def seekOnset(self, direction=1):
+    (clip, overview) = self.currentOverview()
+    if clip is None:
+        return overview
+
+    t = self.playPosition(clip)
+    onset = overview.nextOnset(t) if direction > 0 else overview.previousOnset(t)
+    if onset is None:
+        return "Nothing loud " + ("after" if direction > 0 else "before") + " " + showMark(t) + "."
+    return self.seek(onset)
+
+def speakLevel(self):
+    (clip, overview) = self.currentOverview()
+    if clip is None:
+        return overview
+
+    (peak, rms) = overview.levelAt(self.playPosition(clip))
+    if peak <= silenceLevel:
+        return "Silence."
+    return "Peak " + str(int(round(peak))) + ", average " + str(int(round(rms))) + " decibels."
+
 def isPlaying(self):
-    return self.video_flag.is_set()
+    return self.player.isPlaying()
+
+def playPosition(self, clip):
+    # where we are in clip: what is coming out of the speakers right now if it is playing, on its own or as part of its track, else the seek position
+    if self.isPlaying() and (self.player.clip is getAudioClip(clip)):
+        return self.player.position()
+    playing = self.player.clip
+    if self.isPlaying() and isinstance(playing, Region) and (playing.clip is getAudioClip(clip)):
+        return playing.a + self.player.position()
+    start = self.trackPlaybackStart(clip)
+    if (start is not None) and (start <= self.player.position() < start + clip.duration):
+        return self.player.position() - start
+    return getSeekPos(clip)
+
+def trackPlaybackStart(self, clip):
+    # where clip starts in the mix of the whole track if that is playing and clip is the selected clip of it, else None
+    if not(self.isPlaying()) or (self.playingTrack is None) or (self.player.clip is not self.playingTrack[1]):
+        return None
+    (track, mix, starts) = self.playingTrack
+    if (track is not self.getCurrentTrack()) or track.empty() or (track.get() is not clip) or (track.index >= len(starts)):
+        return None
+    return starts[track.index]
+
+def playTrack(self):
+    # plays the selected track from the seek position of its selected clip on, across all its clips, and mixed with its linked tracks like a merge would be. Nothing is rendered
+    if self.isPlaying():
+        self.player.stop()
+        return ""
+
+    track = self.getCurrentTrack()
+    if track is None:
+        return "No track."
+
+    if track.empty():
+        return "Track has no clips to play."
+
+    if track.atEnd():
+        return "End of track."
+
+    (mix, starts) = track.mixedAudio(self.findChildren)
+    t = starts[track.index] + getSeekPos(track.get())
+    if t >= mix.duration:
+        return "End of track."
+    self.playingTrack = (track, mix, starts)
+    return self.playFrom(mix, t)
 
 def playPause(self, seekOnPause=False):
     # check if we're currently playing
-    if self.video_flag.is_set():
-        self.video_flag.clear()
-        self.video_flag = threading.Event()
-        self.audio_flag = threading.Event()
-        if seekOnPause:
-            if self.playclip is None:
-                return "" # sanity
-            return self.seek(self.playseekpos + self.clock.tick(self.playclip.fps) / 1000)
+    if self.isPlaying():
+        clip = self.getCurrentClip()
+        t = self.playPosition(clip) if clip is not None else None
+        self.player.stop()
+        if seekOnPause and (t is not None):
+            return self.seek(t)
         return ""
 
-
     clip = self.getCurrentClip()
     if not(clip):
         return "No clip to play!"
@@ -1208,27 +1501,69 @@ def playPause(self, seekOnPause=False):
     if getSeekPos(clip) >= clip.duration:
         return "End of clip."
 
-    self.playseekpos = getSeekPos(clip) # this is only for seekOnPause
-    clip = clip.subclip(getSeekPos(clip))
-    audio_fps=22050
-    audio_buffersize=3000
-    audio_nbytes=2
-    if isVideoClip(clip):
-        if clip.audio is None:
-            return "Clip has no audio."
-        clip = clip.audio
+    return self.playFrom(clip, getSeekPos(clip))
+
+def playFrom(self, clip, t):
+    # plays the sound of clip from t on, through the stream that stays open. The seek position stays where it is
+    audio = getAudioClip(clip)
+    if audio is None:
+        return "Clip has no audio."
+
+    try:
+        self.player.play(audio, t)
+    except Exception as e:
+        # no sound device, most likely
+        return "Cannot play: " + str(e)
+    return ""
 
-    audiothread = threading.Thread(
-        target=clip.preview, # important: this is clip.audio.preview for normal video clips
-        args=(audio_fps, audio_buffersize, audio_nbytes, self.audio_flag, self.video_flag),
-    )
-    audiothread.start()
-    self.video_flag.set()
-    self.audio_flag.wait()
-    self.playtime = self.clock.tick(clip.fps) / 1000
-    self.playclip = clip
+def loopRegion(self):
+    # plays the part of the selected clip between the mark and the seek position over and over, until stopped
+    if self.isPlaying():
+        self.player.stop()
+        return ""
 
+    clip = self.getCurrentClip()
+    if clip is None:
+        return "No clip!"
+    audio = getAudioClip(clip)
+    if audio is None:
+        return "Clip has no audio."
+
+    (a, b) = sorted((getMark(clip), getSeekPos(clip)))
+    b = min(b, audio.duration)
+    if b - a < 0.01:
+        return "Mark and seek position are in the same place."
+    return self.playRegion(audio, a, b, loop=True)
+
+def peekMark(self):
+    # plays a little around the mark, from peekLength seconds before to peekLength seconds after it. Hitting it again while it plays starts it over
+    clip = self.getCurrentClip()
+    if clip is None:
+        return "No clip!"
+    audio = getAudioClip(clip)
+    if audio is None:
+        return "Clip has no audio."
 
+    mark = getMark(clip)
+    (a, b) = (max(0, mark - self.peekLength), min(audio.duration, mark + self.peekLength))
+    if b <= a:
+        return "Nothing to play around the mark."
+    return self.playRegion(audio, a, b)
+
+def playRegion(self, audio, a, b, loop=False):
+    # plays audio from a to b seconds, from memory, so that playing the same part again starts right away
+    try:
+        if b - a > maxRegionLength:
+            # too long to keep around, so read it while playing like anything else
+            self.player.play(audio, a, end=b, loop=loop)
+            return ""
+        region = self.playedRegion
+        if (region is None) or not(region.isOf(audio, a, b)):
+            region = Region(audio, a, b)
+            self.playedRegion = region
+        self.player.play(region, loop=loop)
+    except Exception as e:
+        return "Cannot play: " + str(e)
     return ""
 
 def createTextClip(self):
@@ -1243,21 +1578,25 @@ def createTextClip(self):
     if track.isLocked():
         return "Cannot create text clip: Track is locked."
     
-    def cont(w):
-        clip = TextClip(text=w,
+    def makeClip(w):
+        return TextClip(text=w,
                         font='Ariel',
                         interline=200,
                         bg_color="black",
                         color="white",
                         size=sz,
                         method="caption").with_duration(3)
-        if clip is not None:
-            clip.fps = global_fps
-            track.insertClip(clip)
-            self.tts.speak("Created text clip.")
-        else:
-            self.tts.speak("Could not create text clip.")
+
+    def done(clip):
+        if clip is None:
+            return "Could not create text clip."
+        clip.fps = global_fps
+        track.insertClip(clip)
+        return "Created text clip."
+
+    def cont(w):
         self.cancelTextMode()
+        self.startJob("creating a text clip", lambda: makeClip(w), done, priority=PRIORITY_HIGH)
         return True
 
 
@@ -1267,21 +1606,32 @@ def createTextClip(self):
 def recordAudioClip(self):
     # this command can be used to stop a recording that is in progress
     if self.audiorecorder.isRecording():
-        clip = AudioFileClip(self.audiorecorder.stop())
+        file = self.audiorecorder.stop()
         if self.head is not None:
             track = self.head
         else:
             track = self.getCurrentTrack()
 
         if track is None or track.isLocked():
-            w = "Track is locked. " if track.isLocked() else ""            
+            w = "Track is locked. " if (track is not None) and track.isLocked() else ""            
             self.newTrack()
             track = self.getCurrentTrack()
             msg = w + "Stopped audio recording and inserted onto new track " + track.getName()
         else:
             msg = "Stopped audio recording and inserted onto " + track.getName()
-        track.insertClip(clip)
-        return msg
+
+        def load():
+            # the recorder writes out what it has buffered before it lets go of the file
+            self.audiorecorder.join()
+            clip = openAudioFile(file)
+            usePCMCache(clip)
+            return clip
+
+        def done(clip):
+            track.insertClip(clip)
+            return msg
+        self.startJob("loading the recording", load, done, priority=PRIORITY_HIGH)
+        return "Stopped audio recording."
 
     # this happens when we are not currently recording
     if self.head is not None:
@@ -1313,7 +1663,7 @@ def addTag(self, useMark=False):
     if useMark:
         pos = getMark(clip)
     else:
-        pos = getSeekPos(clip)
+        pos = self.playPosition(clip)
         
     def nameCont(w):
         if w == "":
@@ -1397,12 +1747,9 @@ def fadeOutEffect(self):
     return _fadeEffect(self, direction="out")
 
 def _fadeEffect(self, direction):
-    if direction == "out":
-        fade = lambda p, c: c.fadeout(p) if isVideoClip(c) else c.audio_fadeout(p)
-    elif direction == "in":
-        fade = lambda p, c: c.fadein(p) if isVideoClip(c) else c.audio_fadeout(p)    
-    else:
+    if direction not in ["in", "out"]:
         return "Cannot apply fade effect: nonsense direction provided."
+    fade = lambda p, c: makeEditListClip(editListFade(getEditList(c), p, direction))
 
     clip = self.getCurrentClip()
     if clip is None:
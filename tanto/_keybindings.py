@@ -56,8 +56,16 @@ def stdKeybindings(self=None):
          C_EDIT, "resize a clip. Prompts for width and height, one of which can be auto-determined to preserve aspect ratio."),        
         ("=", self.setVolume,
          C_AUDIO, "change the volume of the selected clip. Volume is scaled by a provided factor."),
+        ("N", self.normalizeTrack,
+         C_AUDIO, "normalize the loudness of all clips on the selected track. Prompts for a loudness in LUFS, e.g. 16 for -16 LUFS, measures every clip as in EBU R128 and scales its volume to match."),
         ("SPACE", self.playPause,
          C_SEEK, "start or stop playback of selected clip. Note: Hitting space will send you back to your previous seek location. Use CTRL+SPACE if you want to resume playback from your current location after playback."),
+        ("ALT+SPACE", self.playTrack,
+         C_SEEK, "start or stop playback of the whole selected track, from the seek position of the selected clip on. Linked tracks are mixed in as they would be in a merge, with ducking and volume changes, without rendering anything."),
+        ("SHIFT+SPACE", self.loopRegion,
+         C_SEEK, "start or stop playing the part of the selected clip between the mark and the seek position in a loop."),
+        ("k", self.peekMark,
+         C_SEEK, "play a second before and after the mark of the selected clip. Hit it again to hear it again."),
         ("CTRL+SPACE", lambda: self.playPause(seekOnPause=True),
          C_SEEK, "start and pause playback. When you pause using this command during playback, the seek position is set to whatever part of the clip you just paused at. This is the normal behaviour of most vide oplayers, but can be counter productive for editing."),
         ("j", self.setHead,
@@ -82,6 +90,8 @@ def stdKeybindings(self=None):
          C_EDIT, "bisect the selected clip at the current seek position. Creates a new temporary track with the two resulting partial clips in place of the whole one."),
         ("V", lambda: self.bisect(inPlace=True),
          C_EDIT, "bisect in-place. Create two new clips in place of the whole one on the selected track."),
+        ("%", self.splitAtSilences,
+         C_EDIT, "split the selected clip at every pause, and put the pieces on a new track. Prompts for the level that counts as silence and the minimum length of a pause. File clips are split without reencoding, so video pieces start on the keyframe nearest to the middle of each pause."),
         ("c", self.copyToHead,
          C_PROGRAM, "copy the selected clip to the head position. Useful for bulk,copying small clips to an accumulator track."),
         ("ALT+c", self.createCloneTrack,
@@ -118,6 +128,12 @@ def stdKeybindings(self=None):
          C_PROGRAM, "save the selected clip to disk."),
         ("_", self.saveTrack,
          C_TRACK, "save the current track to disk, rendering all its clips. This command may take a while."),
+        ("R", self.toggleRenderProfile,
+         C_PROGRAM, "switch between draft and final render quality. Drafts render at low resolution and frame rate with the fastest encoder settings. They are good for checking a merge, but not for sharing."),
+        ("L", self.listJobs,
+         C_PROGRAM, "list the jobs running in the background, and how far along they are. Cutting, merging, saving and creating voice and text clips happens in the background, so you can keep editing in the meantime. Long jobs tell you how far along they are every now and then."),
+        ("CTRL+k", self.cancelJob,
+         C_PROGRAM, "cancel the background job started last. Partially written files are removed."),
         ("CTRL+d", self.removeClip,
          C_EDIT, "delete the selected clip. This moves a clip the the graveyard, it won't remove it from your disk."),
         ("ALT+d", self.removeTrack,
@@ -174,6 +190,16 @@ def stdKeybindings(self=None):
          C_SEEK, "seek forward in the selected clip by a large amount."),
         ("B", lambda: self.seekRelative((-1)*self.largeTimeStep),
          C_SEEK, "seek backward in the selected clip by a large amount."),
+        (".", lambda: self.seekSilence(1),
+         C_SEEK, "seek forward to the start of the next pause in the sound of the current clip, and speak how long it is."),
+        (",", lambda: self.seekSilence(-1),
+         C_SEEK, "seek back to the start of the previous pause in the sound of the current clip."),
+        ("o", lambda: self.seekOnset(1),
+         C_SEEK, "seek forward to where the sound next gets loud after being quiet, e.g. the next sentence or the next beat."),
+        ("O", lambda: self.seekOnset(-1),
+         C_SEEK, "seek back to where the sound last got loud after being quiet."),
+        ("l", self.speakLevel,
+         C_SEEK, "speak the loudness of the sound at the seek position, as peak and average level in decibels below full scale."),
         ('"', self.createTextClip,
          C_EFFECT, "create a 3 second text clip based on text provided by user."),
         ("$", self.createImageClip,
@@ -3,6 +3,7 @@ from unittest.mock import Mock
 from argparse import *
 from tanto.tanto_utility import *
 from tanto import _keybindings
+from tanto.render import defaultWorkers
 import tanto
 
 def mkVersion():
@@ -46,6 +47,11 @@ def makeArgParser():
     p.add_argument("-e", "--engine", type=str, choices=["spd-say", "espeak", "say", "*platform*"], default="*platform*", help="The TTS engine used throughout the program. Only a limited set is supported currently. If you choose a particular one, make sure it is available on your platform. The default of *platform* will automatically pick an engine according to your operating system.")
     p.add_argument("-i", "--volume", type=str, default=None, help="Set the volume (or intensity) for the TTS engine.")
     p.add_argument("--fullscreen", action=BooleanOptionalAction, default=False, help="Start in fullscreen mode.")
+    p.add_argument("-j", "--jobs", type=int, default=defaultWorkers(), help="Number of clips to render in parallel when saving tracks. Each job runs its own encoder, so the number of CPU cores is usually a good choice.")
+    p.add_argument("--cache-size", type=int, default=10240, help="Maximum size in megabytes of the render cache in the project directory. Rendered merges and clips are kept there, so unchanged parts of a project don't have to be rendered again. Least recently used files are removed first.")
+    p.add_argument("--sample-rate", type=int, default=44100, help="Sample rate of the project in Hz. All sound is converted to it once, as it is read in, and mixed, played, recorded and written at it.")
+    p.add_argument("--pcm-cache-size", type=int, default=4096, help="Maximum size in megabytes of the decoded audio kept in the project directory. Audio is decoded once, so that playing and merging don't have to decode it again and again. Least recently used files are removed first.")
+    p.add_argument("--job-threads", type=int, default=4, help="Number of background jobs, like cuts, merges and saves, that may run at once. Further jobs wait their turn, with quick ones going before long renders.")
     p.add_argument("--theme", type=str, default="", help="Path to a json theme file to customize the GUI appearance.")
 
     return p
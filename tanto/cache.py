@@ -0,0 +1,197 @@
+import os, glob, hashlib, shutil, numbers
+from types import MethodType, FunctionType, BuiltinFunctionType, ModuleType, CodeType
+from tempfile import NamedTemporaryFile
+import numpy as np
+from tanto.clip import *
+from tanto.clip import _clipGraphChildren
+
+# Render cache
+# Rendered clips are stored in the project directory, under a hash of everything that went into them. Rendering an unchanged clip again just links the earlier result.
+
+# attributes that don't change what a clip looks or sounds like. The owner ids in particular are different on every run
+_volatileAttributes = "fileowner edlowner renderKey renderKeyOwner seekpos mark childTracks memoized_t memoized_frame bitrate overview overviewOwner loudnessCurve loudnessOwner _batch".split(" ")
+
+class Uncacheable(Exception):
+    pass
+
+def clipHash(obj):
+    """Returns a hex digest identifying the output of a clip, or of a structure of lists, tuples and dicts with clips in it. Source files are identified by path, modification time and size. Returns None if the clip contains something we don't know how to identify."""
+    h = hashlib.sha1()
+    seen = {}
+    stack = [obj]
+    try:
+        while stack:
+            x = stack.pop()
+            if id(x) in seen:
+                # shared or cyclic structure
+                h.update(("ref:" + str(seen[id(x)]) + ";").encode())
+                continue
+            (desc, children) = _hashNode(x)
+            if children is not None:
+                # only containers can be shared meaningfully. Small values like floats get new ids all the time
+                seen[id(x)] = len(seen)
+            h.update((desc + ";").encode())
+            if children:
+                stack += reversed(children)
+    except Uncacheable:
+        return None
+    return h.hexdigest()
+
+def _fileDesc(file):
+    try:
+        st = os.stat(file)
+    except OSError:
+        raise Uncacheable()
+    return file + ":" + str(st.st_mtime) + ":" + str(st.st_size)
+
+def _hashNode(x):
+    # returns a string describing x itself, and the list of children that still need to be hashed (None for leaves)
+    if (x is None) or isinstance(x, (bool, str, bytes)):
+        return (type(x).__name__ + ":" + repr(x), None)
+    if isinstance(x, (numbers.Number, np.number)):
+        return ("num:" + repr(float(x)), None)
+    if isinstance(x, np.ndarray):
+        return ("array:" + str(x.shape) + str(x.dtype) + hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest(), None)
+    if isinstance(x, (FFMPEG_VideoReader, FFMPEG_AudioReader)):
+        # readers are where the actual source material comes from
+        params = [str(x.__dict__.get(k, None)) for k in ["size", "fps", "nchannels", "nbytes", "pixel_format"]]
+        return (type(x).__name__ + ":" + _fileDesc(x.filename) + ":" + ":".join(params), None)
+    if isinstance(x, PCMReader):
+        # plays the same samples as the reader it stands in for
+        return _hashNode(x.fallback)
+    if isinstance(x, ModuleType):
+        return ("module:" + x.__name__, None)
+    if isinstance(x, BuiltinFunctionType):
+        return ("builtin:" + str(getattr(x, "__module__", "")) + "." + x.__qualname__, None)
+    if isinstance(x, FunctionType):
+        return ("function:" + _codeDesc(x.__code__), _clipGraphChildren(x))
+    if isinstance(x, MethodType):
+        return ("method:", _clipGraphChildren(x))
+    if isinstance(x, (list, tuple)):
+        return (type(x).__name__ + ":" + str(len(x)), list(x))
+    if isinstance(x, dict):
+        keys = sorted([k for k in x.keys() if isinstance(k, str)], key=str)
+        if len(keys) != len(x):
+            raise Uncacheable()
+        return ("dict:" + ",".join(keys), [x[k] for k in keys])
+    if isinstance(x, Envelope):
+        return ("envelope:", [x.times, x.gains])
+    if isinstance(x, (Clip, Segment)):
+        keys = sorted([k for k in x.__dict__.keys() if k not in _volatileAttributes])
+        return (type(x).__name__ + ":" + ",".join(keys), [x.__dict__[k] for k in keys])
+    # PIL images, open files and whatever else might hide in a closure
+    raise Uncacheable()
+
+def _codeDesc(code):
+    consts = [(_codeDesc(c) if isinstance(c, CodeType) else repr(c)) for c in code.co_consts]
+    return hashlib.sha1(code.co_code + repr((code.co_names, consts)).encode()).hexdigest()
+
+
+def setRenderKey(clip, key):
+    clip.renderKey = key
+    clip.renderKeyOwner = id(clip)
+
+def hasRenderKey(clip):
+    return ("renderKey" in clip.__dict__) and (clip.__dict__.get("renderKeyOwner", None) == id(clip))
+
+def getRenderKey(clip):
+    """Returns the key under which the rendered output of clip is cached. This is usually its hash, but merges set a cheaper key describing the track instead."""
+    if hasRenderKey(clip):
+        return clip.renderKey
+    return clipHash(clip)
+
+
+class RenderCache(object):
+    def __init__(self, dir, maxBytes=10*1024**3):
+        """Creates a cache of rendered files in dir, which will be created if necessary. When the cache grows larger than maxBytes, least recently used files are removed."""
+        self.dir = dir
+        self.maxBytes = maxBytes
+        if not(os.path.isdir(dir)):
+            os.makedirs(dir)
+
+    def _entries(self):
+        # only files named after a key are entries, the rest are checked out temp files
+        return [file for file in glob.glob(os.path.join(self.dir, "*")) if len(os.path.splitext(os.path.basename(file))[0]) == 40]
+
+    def lookup(self, key):
+        """Returns the cached file for key, or None."""
+        if key is None:
+            return None
+        files = glob.glob(os.path.join(self.dir, key + ".*"))
+        if files == []:
+            return None
+        # we track recency through the modification time
+        os.utime(files[0])
+        return files[0]
+
+    def fetch(self, key, file):
+        """Puts the cached file for key at file. Returns False if there is no such entry."""
+        cached = self.lookup(key)
+        if cached is None:
+            return False
+        _linkOrCopy(cached, file)
+        return True
+
+    def checkout(self, key):
+        """Returns a clip for the cached file of key, which saveClip may move around like any other temporary clip. Returns None if key isn't cached."""
+        cached = self.lookup(key)
+        if cached is None:
+            return None
+
+        (_, ext) = os.path.splitext(cached)
+        f = NamedTemporaryFile(suffix=ext, dir=self.dir, delete=False)
+        f.close()
+        os.remove(f.name)
+        _linkOrCopy(cached, f.name)
+        global_temp_clips.append(f.name)
+        if isVideoFile(cached):
+            clip = openVideoFile(f.name)
+        else:
+            clip = openAudioFile(f.name)
+        setFilepath(clip, f.name)
+        setRenderKey(clip, key)
+        return clip
+
+    def store(self, key, file):
+        """Adds a rendered file to the cache under key."""
+        if key is None:
+            return
+        (_, ext) = os.path.splitext(file)
+        for old in glob.glob(os.path.join(self.dir, key + ".*")):
+            os.remove(old)
+        _linkOrCopy(file, os.path.join(self.dir, key + ext))
+        self.evict()
+
+    def evict(self):
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        # entries may be hardlinks of each other, which only take up space once
+        inodes = {}
+        for file in entries:
+            st = os.stat(file)
+            (n, size) = inodes.get((st.st_dev, st.st_ino), (0, st.st_size))
+            inodes[(st.st_dev, st.st_ino)] = (n+1, size)
+        total = sum([size for (n, size) in inodes.values()])
+        while entries and (total > self.maxBytes):
+            file = entries.pop(0)
+            st = os.stat(file)
+            os.remove(file)
+            (n, size) = inodes[(st.st_dev, st.st_ino)]
+            inodes[(st.st_dev, st.st_ino)] = (n-1, size)
+            if n == 1:
+                total -= size
+
+
+def _linkOrCopy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        # free, if both are on the same filesystem
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def saveKey(renderKey, file, kwargs):
+    # the same clip rendered to another format or bitrate is a different file
+    if renderKey is None:
+        return None
+    return clipHash((renderKey, getExtension(file), kwargs))
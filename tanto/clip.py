@@ -1,9 +1,22 @@
-import os, subprocess, shutil
+import os, subprocess, shutil, re, inspect
+from bisect import bisect_right
+import numpy as np
 from tempfile import NamedTemporaryFile
+from multiprocessing.pool import ThreadPool
 from subprocess import run
+from types import MethodType, FunctionType, CodeType
 from moviepy.editor import *
+from moviepy.Clip import Clip
+from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader
+from moviepy.audio.io.readers import FFMPEG_AudioReader
 from tanto.tanto_utility import *
 from tanto.definitions import *
+from tanto.frameindex import *
+from tanto.progress import *
+from tanto.mixer import *
+from tanto.pcm import *
+from tanto.overview import *
+from tanto.loudness import *
 
 # I don't like the python tempfile architecture, it makes me do things like this
 
@@ -18,10 +31,22 @@ def getFilepath(clip):
 
 def setFilepath(clip, filepath):
     clip.filepath = filepath
+    # moviepy copies the __dict__ on every with_*, subclip and fx call, so copies of a file clip will still carry the filepath around. We remember which object the file actually belongs to.
+    clip.fileowner = id(clip)
+    usePCMCache(clip)
+    # start on the overview right away, so it's there by the time anyone navigates by it
+    if (clip if isAudioClip(clip) else clip.audio) is not None:
+        clipOverview(clip)
 
 def isFileClip(clip):
     return getFilepath(clip) is not None
 
+def isUnmodifiedFileClip(clip):
+    """Returns True if clip plays exactly the file it is associated with, i.e. it is not a subclip, a copy with effects applied etc."""
+    if not(isFileClip(clip)):
+        return False
+    return clip.__dict__.get("fileowner", None) == id(clip)
+
 def getSeekPos(clip):
     if not("seekpos" in clip.__dict__):
         return 0
@@ -48,6 +73,276 @@ def getChildTracks(clip):
     return []
 
 
+def clipGraph(clip):
+    """Returns a list of all objects reachable from a clip, in depth-first order. This includes subclips, audio and masks, file readers, and the functions (with their closures) that moviepy builds derived clips from."""
+    # no recursion here, the whole point is that clip trees can get very deep
+    acc = []
+    seen = set()
+    stack = [clip]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        acc.append(obj)
+        stack += reversed(_clipGraphChildren(obj))
+    return acc
+
+def _clipGraphChildren(obj):
+    if isinstance(obj, (list, tuple)):
+        return list(obj)
+    if isinstance(obj, dict):
+        return list(obj.values())
+    if isinstance(obj, MethodType):
+        return [obj.__self__, obj.__func__]
+    if isinstance(obj, FunctionType):
+        acc = list(obj.__defaults__ or [])
+        for cell in (obj.__closure__ or []):
+            try:
+                acc.append(cell.cell_contents)
+            except ValueError:
+                # empty cell
+                pass
+        return acc
+    if isinstance(obj, (Clip, Segment)):
+        return list(obj.__dict__.values())
+    if isinstance(obj, PCMReader):
+        # the ffmpeg reader still has to be reopened in forked workers, in case the decoded audio isn't ready yet
+        return [obj.fallback]
+    return []
+
+def findReaders(clip):
+    """Returns the ffmpeg readers a clip gets its frames from."""
+    return [obj for obj in clipGraph(clip) if isinstance(obj, (FFMPEG_VideoReader, FFMPEG_AudioReader))]
+
+
+# Edit lists
+# Editing a clip with moviepy means wrapping it in another subclip, composite or fx layer, so after a couple of cuts every frame has to travel through a deep tree of clips.
+# Instead, edited clips keep a flat list of segments into their source clips. Further edits just split, drop or modify segments, and frames are always fetched directly from the sources.
+
+class Segment(object):
+    """One entry in an edit list. Plays source from tin to tout, with audio scaled by gain, fading in and out over the given durations at the start and end of the segment. A segment that is a piece of a longer one may start fadeInOffset seconds into a fade-in, and end fadeOutOffset seconds before a fade-out is over."""
+    def __init__(self, source, tin, tout, gain=1.0, fadeIn=0, fadeOut=0, fadeInOffset=0, fadeOutOffset=0):
+        self.source = source
+        self.tin = tin
+        self.tout = tout
+        self.gain = gain
+        self.fadeIn = fadeIn
+        self.fadeOut = fadeOut
+        self.fadeInOffset = fadeInOffset
+        self.fadeOutOffset = fadeOutOffset
+
+    def getFile(self):
+        if isUnmodifiedFileClip(self.source):
+            return getFilepath(self.source)
+        return None
+
+    def duration(self):
+        return self.tout - self.tin
+
+    def split(self, t):
+        # t is relative to the segment start. Both pieces keep the parts of the fades that reach into them, so that together they still sound exactly like the whole
+        (left, right) = (self.copy(), self.copy())
+        left.tout = right.tin = self.tin + t
+        left.fadeOutOffset += self.duration() - t
+        right.fadeInOffset += t
+        for seg in [left, right]:
+            if seg.fadeIn - seg.fadeInOffset <= 0:
+                (seg.fadeIn, seg.fadeInOffset) = (0, 0)
+            if seg.fadeOut - seg.fadeOutOffset <= 0:
+                (seg.fadeOut, seg.fadeOutOffset) = (0, 0)
+        return (left, right)
+
+    def copy(self, source=None):
+        return Segment(self.source if source is None else source, self.tin, self.tout, gain=self.gain, fadeIn=self.fadeIn, fadeOut=self.fadeOut, fadeInOffset=self.fadeInOffset, fadeOutOffset=self.fadeOutOffset)
+
+    def fadeFactor(self, t):
+        # t is relative to the segment start, and may be a numpy array
+        x = np.ones_like(np.asarray(t, dtype=float))
+        if self.fadeIn > 0:
+            x = x * np.clip((t + self.fadeInOffset) / self.fadeIn, 0, 1)
+        if self.fadeOut > 0:
+            x = x * np.clip((self.duration() - t + self.fadeOutOffset) / self.fadeOut, 0, 1)
+        return x
+
+    def continues(self, prev):
+        """Returns True if this segment plays on where prev stops, so that the two can be one segment."""
+        if not((prev.source is self.source) and (prev.tout == self.tin) and (prev.gain == self.gain)):
+            return False
+        # a fade may only carry over into the other segment if it is the same fade
+        fadeIn = (self.fadeIn == 0) and (prev.fadeIn - prev.fadeInOffset <= prev.duration())
+        fadeIn = fadeIn or ((self.fadeIn == prev.fadeIn) and np.isclose(self.fadeInOffset, prev.fadeInOffset + prev.duration()))
+        fadeOut = (prev.fadeOut == 0) and (self.fadeOut - self.fadeOutOffset <= self.duration())
+        fadeOut = fadeOut or ((self.fadeOut == prev.fadeOut) and np.isclose(prev.fadeOutOffset, self.fadeOutOffset + self.duration()))
+        return fadeIn and fadeOut
+
+    def __str__(self):
+        return "Segment(tin=" + str(self.tin) + ", tout=" + str(self.tout) + ", gain=" + str(self.gain) + ", fadeIn=" + str(self.fadeIn) + ", fadeOut=" + str(self.fadeOut) + ", fadeInOffset=" + str(self.fadeInOffset) + ", fadeOutOffset=" + str(self.fadeOutOffset) + ")"
+
+    def __repr__(self):
+        return str(self)
+
+
+def hasEditList(clip):
+    # like with filepaths, copies made by moviepy carry the edit list along even though they may play something else
+    return ("edl" in clip.__dict__) and (clip.__dict__.get("edlowner", None) == id(clip))
+
+def getEditList(clip):
+    """Returns the flat list of segments a clip plays. Clips that weren't created from an edit list are a single segment over themselves."""
+    if hasEditList(clip):
+        return clip.edl
+    return [Segment(clip, 0, clip.duration)]
+
+def editListDuration(segments):
+    return sum([seg.duration() for seg in segments])
+
+def editListSlice(segments, a, b):
+    """Returns the segments that play the time from a to b of the clip described by segments."""
+    acc = []
+    start = 0
+    for seg in segments:
+        end = start + seg.duration()
+        if (end <= a) or (start >= b):
+            start = end
+            continue
+
+        seg = seg.copy()
+        if b < end:
+            seg = seg.split(b - start)[0]
+        if a > start:
+            seg = seg.split(a - start)[1]
+        acc.append(seg)
+        start = end
+    return acc
+
+def editListCut(segments, a, b):
+    """Removes the time from a to b."""
+    return joinEditLists(editListSlice(segments, 0, a), editListSlice(segments, b, editListDuration(segments)))
+
+def editListGain(segments, a, b, factor):
+    """Scales the volume from a to b by factor."""
+    middle = editListSlice(segments, a, b)
+    for seg in middle:
+        seg.gain *= factor
+    return joinEditLists(editListSlice(segments, 0, a), middle, editListSlice(segments, b, editListDuration(segments)))
+
+def editListFade(segments, duration, direction="in"):
+    """Fades the clip in at the start or out at the end. The fade belongs to the first or last segment, and is cut short if that segment is shorter than duration."""
+    segments = [seg.copy() for seg in segments]
+    if segments == []:
+        return segments
+    if direction == "in":
+        (segments[0].fadeIn, segments[0].fadeInOffset) = (min(duration, segments[0].duration()), 0)
+    else:
+        (segments[-1].fadeOut, segments[-1].fadeOutOffset) = (min(duration, segments[-1].duration()), 0)
+    return segments
+
+def joinEditLists(*lists):
+    # glue segments back together where a cut didn't remove anything, so the list doesn't grow with every edit
+    acc = []
+    for seg in [seg for segments in lists for seg in segments]:
+        if seg.duration() <= 0:
+            continue
+        if acc:
+            prev = acc[-1]
+            if seg.continues(prev):
+                acc[-1] = Segment(prev.source, prev.tin, seg.tout, gain=prev.gain, fadeIn=prev.fadeIn, fadeOut=seg.fadeOut, fadeInOffset=prev.fadeInOffset, fadeOutOffset=seg.fadeOutOffset)
+                continue
+        acc.append(seg)
+    return acc
+
+def _matchChannels(frames, nchannels):
+    if frames.ndim == 1:
+        frames = frames[:, None]
+    if frames.shape[1] == nchannels:
+        return frames
+    if frames.shape[1] == 1:
+        return np.repeat(frames, nchannels, axis=1)
+    if frames.shape[1] > nchannels:
+        return frames[:, :nchannels]
+    return np.hstack([frames] + [frames[:, -1:]] * (nchannels - frames.shape[1]))
+
+def _editListStarts(segments):
+    starts = [0]
+    for seg in segments[:-1]:
+        starts.append(starts[-1] + seg.duration())
+    return starts
+
+def makeEditListAudioClip(segments, fps=None, nchannels=None):
+    sources = [seg.source for seg in segments if seg.source is not None]
+    if fps is None:
+        fps = next((src.fps for src in sources if "fps" in src.__dict__ and src.fps), projectFps())
+    if nchannels is None:
+        nchannels = max([src.nchannels for src in sources if "nchannels" in src.__dict__] + [1])
+    starts = np.array(_editListStarts(segments))
+
+    def make_frame(t):
+        tt = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.zeros((len(tt), nchannels))
+        idx = np.searchsorted(starts, tt, side="right") - 1
+        for i in np.unique(idx):
+            if (i < 0) or (i >= len(segments)):
+                continue
+            seg = segments[i]
+            mask = idx == i
+            local = tt[mask] - starts[i]
+            inside = local < seg.duration()
+            if (seg.source is None) or isSilent(seg.source) or not(inside.any()):
+                # silent gap, e.g. a video clip without audio
+                continue
+            frames = _matchChannels(np.asarray(seg.source.get_frame(seg.tin + local[inside])), nchannels)
+            (values, env) = (np.zeros((len(local), nchannels)), seg.gain * seg.fadeFactor(local[inside]))
+            values[inside] = frames * env[:, None]
+            out[mask] = values
+        if np.ndim(t) == 0:
+            return out[0]
+        return out
+
+    clip = AudioClip(make_frame, duration=editListDuration(segments), fps=fps)
+    clip.edl = segments
+    clip.edlowner = id(clip)
+    return clip
+
+def makeEditListClip(segments):
+    """Creates a clip that plays the given segments one after another."""
+    if segments == []:
+        return None
+
+    if isAudioClip(segments[0].source):
+        return makeEditListAudioClip(segments)
+
+    starts = _editListStarts(segments)
+    def make_frame(t):
+        i = min(max(0, bisect_right(starts, t) - 1), len(segments) - 1)
+        seg = segments[i]
+        local = min(t - starts[i], seg.duration())
+        frame = seg.source.get_frame(seg.tin + local)
+        x = seg.fadeFactor(local)
+        if x < 1:
+            # fade to black
+            return (frame * x).astype("uint8")
+        return frame
+
+    clip = VideoClip(make_frame, duration=editListDuration(segments))
+    fps = [seg.source.fps for seg in segments if "fps" in seg.source.__dict__ and seg.source.fps]
+    if fps:
+        clip.fps = fps[0]
+    if [seg for seg in segments if seg.source.audio is not None]:
+        audioSegments = [seg.copy(source=seg.source.audio) for seg in segments]
+        clip.audio = makeEditListAudioClip(audioSegments)
+    clip.edl = segments
+    clip.edlowner = id(clip)
+    return clip
+
+def editSubclip(clip, a, b=None):
+    """Like clip.subclip, but returns a flat edit list clip."""
+    if b is None:
+        b = clip.duration
+    if b <= a:
+        return clip.subclip(0, 0)
+    return makeEditListClip(editListSlice(getEditList(clip), a, b))
+
+
 def isAudioClip(clip):
     return isinstance(clip, AudioClip)
 
@@ -55,6 +350,146 @@ def isVideoClip(clip):
     return (isinstance(clip, VideoClip) or isinstance(clip, TextClip))
 
 
+# Overviews of clips
+# Overviews are made per source file. The overview of a clip is pieced together from the overviews of the files it plays, following its edit list. Anything else, like a mix or a clip with effects, gets an overview of its own.
+
+# the frame function AudioFileClip gives its clips. Effects and subclips replace it, with functions that may well read through the same clip
+_audioFileFrameCode = [c for c in inspect.unwrap(AudioFileClip.__init__).__code__.co_consts if isinstance(c, CodeType) and (c.co_name == "<lambda>")]
+
+def _fileReader(audio):
+    # the reader of an audio file clip, if the clip plays the file as it is
+    if not(isinstance(audio, AudioFileClip)) or (getattr(audio.make_frame, "__code__", None) not in _audioFileFrameCode):
+        return None
+    return audio.reader
+
+def _audioPieces(audio):
+    # (reader, tin, tout, segment) for every piece of the sound, with reader None for silent gaps. None if the sound isn't just pieces of files
+    if hasEditList(audio):
+        pieces = []
+        for seg in audio.edl:
+            gap = (seg.source is None) or isSilent(seg.source)
+            reader = None if gap else _fileReader(seg.source)
+            if not(gap) and (reader is None):
+                return None
+            pieces.append((reader, seg.tin, seg.tout, seg))
+        return pieces
+    if isSilent(audio):
+        return [(None, 0, audio.duration, None)]
+    reader = _fileReader(audio)
+    if reader is None:
+        return None
+    return [(reader, 0, audio.duration, None)]
+
+def clipOverview(clip):
+    """Returns the Overview of the sound of clip, which must have some, or None if it isn't ready yet. It is then made in the background, so asking again later will do."""
+    audio = clip if isAudioClip(clip) else clip.audio
+    if audio.__dict__.get("overviewOwner", None) == id(audio):
+        return audio.overview
+
+    pieces = _audioPieces(audio)
+    if pieces is None:
+        # we have to go through the sound itself, once
+        def build():
+            fps = audio.fps or projectFps()
+            audio.overview = makeOverview(lambda a, b: audio.get_frame(np.arange(a, b) / fps), fps, audio.duration)
+            audio.overviewOwner = id(audio)
+        scheduleOverview(("clip", id(audio)), build)
+        return None
+
+    overviews = [sourceOverview(reader) if reader is not None else None for (reader, tin, tout, seg) in pieces]
+    if [1 for (piece, overview) in zip(pieces, overviews) if (piece[0] is not None) and (overview is None)]:
+        return None
+
+    (peaks, rms) = ([], [])
+    start = 0
+    for ((reader, tin, tout, seg), overview) in zip(pieces, overviews):
+        # block numbers in clip time, so that rounding doesn't add up over many segments
+        (a, b) = (int(round(start * blockRate)), int(round((start + tout - tin) * blockRate)))
+        if overview is None:
+            (p, r) = (np.zeros(b - a, dtype=np.float32), np.zeros(b - a, dtype=np.float32))
+        else:
+            first = int(round(tin * blockRate))
+            (p, r) = overview.blocks(first, first + b - a)
+        if seg is not None:
+            env = seg.gain * seg.fadeFactor(np.arange(b - a) / blockRate)
+            (p, r) = (p * env, r * env)
+        peaks.append(p)
+        rms.append(r)
+        start += tout - tin
+
+    audio.overview = Overview(np.concatenate(peaks + [[]]), np.concatenate(rms + [[]]))
+    audio.overviewOwner = id(audio)
+    return audio.overview
+
+
+# Loudness of clips
+# Like overviews, the loudness of a clip is worked out from the measurements of the files it plays, following its edit list. Anything else is played into ffmpeg and measured as it is.
+
+def _measureClip(audio, progress=None):
+    fps = audio.fps or projectFps()
+    (n, chunk) = (int(round(audio.duration * fps)), 10 * fps)
+    def feed(stdin):
+        for a in range(0, n, chunk):
+            frames = _matchChannels(np.asarray(audio.get_frame(np.arange(a, min(n, a + chunk)) / fps)), audio.nchannels)
+            stdin.write(frames.astype("<f4").tobytes())
+    return measureLoudness(["-f", "f32le", "-ar", str(fps), "-ac", str(audio.nchannels), "-i", "-"], progress=progress, feed=feed)
+
+def clipLoudness(clip, progress=None):
+    """Returns the integrated loudness of the sound of clip in LUFS, or None if it has none or is silent. Files it plays are measured if they weren't before, which takes a while, see analyseLoudness."""
+    audio = getAudioClip(clip)
+    if audio is None:
+        return None
+    pieces = _audioPieces(audio)
+    if pieces is None:
+        if audio.__dict__.get("loudnessOwner", None) != id(audio):
+            audio.loudnessCurve = _measureClip(audio, progress)
+            audio.loudnessOwner = id(audio)
+        return audio.loudnessCurve.integrated()
+
+    energies = []
+    for (reader, tin, tout, seg) in pieces:
+        if reader is None:
+            continue
+        curve = sourceCurve(reader, progress)
+        if seg is None:
+            energies.append(curve.energies(tin, tout))
+        else:
+            energies.append(curve.energies(tin, tout, gain=seg.gain, envelope=seg.fadeFactor))
+    return integratedLoudness(np.concatenate(energies + [[]]))
+
+def analyseLoudness(clips, workers=None):
+    """Returns the loudness of each of clips, see clipLoudness. Every file they play is measured once, by as many ffmpeg processes at a time as there are cores, unless workers says otherwise."""
+    progress = currentProgress()
+    work = {}
+    for clip in clips:
+        audio = getAudioClip(clip)
+        if audio is None:
+            continue
+        pieces = _audioPieces(audio)
+        if pieces is None:
+            work[("clip", id(audio))] = (audio.duration, (lambda audio: lambda: clipLoudness(audio, progress))(audio))
+            continue
+        for (reader, tin, tout, seg) in pieces:
+            if (reader is None) or (knownCurve(reader) is not None):
+                continue
+            key = sourceKey(reader)
+            if (key is not None) and (key not in work):
+                work[key] = (reader.duration, (lambda reader: lambda: sourceCurve(reader, progress))(reader))
+
+    if progress is not None:
+        progress.expect(sum([duration for (duration, measure) in work.values()]))
+    if work:
+        with ThreadPool(min(len(work), workers or os.cpu_count() or 1)) as pool:
+            pool.map(lambda measure: measure(), [measure for (duration, measure) in work.values()])
+    # everything is measured now, so this is quick
+    return [clipLoudness(clip) for clip in clips]
+
+def normalizeGain(loudness, target=None):
+    """Returns the factor that brings sound of the given loudness to target LUFS, which defaults to targetLoudness."""
+    target = targetLoudness if target is None else target
+    return 10 ** ((target - loudness) / 20)
+
+
 def resetClipPositions(clip):
     setSeekPos(clip, 0)
     setMark(clip, 0)
@@ -67,16 +502,87 @@ def getAudioClip(clip):
         return clip
     return clip.audio
 
-def ffmpeg_run(args, input=None, output="out.mkv"):
+def ffmpeg_run(args, input=None, output="out.mkv", inputOptions=[]):
     if input is not None:
         inputargs = ["-i", input]
     else:
         inputargs = []
 
-    cmd = ["ffmpeg", "-y"] + inputargs + args + [output]
+    cmd = ["ffmpeg", "-y"] + inputOptions + inputargs + args + [output]
     return subprocess.run(cmd) # add capture_output=True to supress spam
 
+def makeTempClipFile(extension):
+    # like in ffmpeg_subclip, these are cleaned up on program exit, or moved into place by saveClip
+    f = NamedTemporaryFile(suffix=extension, delete=False)
+    f.close()
+    global_temp_clips.append(f.name)
+    return f.name
+
+
+_streamSignatures = {}
+def ffmpeg_streams(file):
+    """Returns a list of (type, description) pairs for all streams in a file, as reported by ffmpeg. Bitrates are left out, since files with different bitrates can still be joined without reencoding."""
+    st = os.stat(file)
+    key = (file, st.st_mtime, st.st_size)
+    if key in _streamSignatures:
+        return _streamSignatures[key]
+
+    r = subprocess.run(["ffmpeg", "-hide_banner", "-i", file], capture_output=True, text=True)
+    acc = []
+    for line in r.stderr.splitlines():
+        m = re.match(r"\s*Stream #\d+:\d+.*?: (Video|Audio|Subtitle|Data|Attachment): (.*)", line)
+        if m is None:
+            continue
+        fields = [w.strip() for w in m.group(2).replace("(default)", "").split(",")]
+        acc.append((m.group(1), ", ".join([w for w in fields if not(w.endswith("kb/s"))])))
+    _streamSignatures[key] = acc
+    return acc
+
+def canStreamCopy(clips):
+    """Returns True if clips can be joined with ffmpeg's concat demuxer without reencoding. This requires all clips to be untouched files in the same container format, with identical stream layout and codec parameters."""
+    if clips == []:
+        return False
+
+    if not(all(map(isUnmodifiedFileClip, clips))):
+        return False
+
+    files = [getFilepath(clip) for clip in clips]
+    exts = set([os.path.splitext(file)[1].lower() for file in files])
+    if len(exts) != 1:
+        return False
+
+    try:
+        signatures = [ffmpeg_streams(file) for file in files]
+    except OSError:
+        return False
+    if signatures[0] == []:
+        return False
+    return all([sig == signatures[0] for sig in signatures])
+
+def ffmpeg_concat(clips):
+    """Joins file clips with ffmpeg's concat demuxer, copying streams instead of reencoding them. Check with canStreamCopy first. Returns the resulting clip, or None if ffmpeg failed."""
+    files = [getFilepath(clip) for clip in clips]
+    (_, extension) = os.path.splitext(files[0])
+    listfile = NamedTemporaryFile("w", suffix=".txt", delete=False)
+    for file in files:
+        listfile.write("file '" + os.path.abspath(file).replace("'", "'\\''") + "'\n")
+    listfile.close()
+
+    output = makeTempClipFile(extension)
+    r = ffmpeg_run(["-map", "0", "-c", "copy"], input=listfile.name, output=output, inputOptions=["-f", "concat", "-safe", "0"])
+    os.remove(listfile.name)
+    if r.returncode != 0:
+        return None
+
+    if isVideoClip(clips[0]):
+        out = openVideoFile(output)
+    else:
+        out = openAudioFile(output)
+    setFilepath(out, output)
+    return out
+
 def ffmpeg_subclip(clip, start, end=None):
+    """Cuts the file of clip from start to end with stream copy. Returns (clip, start, end), with the times the cut actually happened at. Video can only be cut on a keyframe, so start moves to the one nearest to it."""
     if end is None:
         end = clip.duration
 
@@ -88,28 +594,132 @@ def ffmpeg_subclip(clip, start, end=None):
     # FIXME: this tmpfile isn't being deleted. in some cases that may eventually cause trouble
     f = NamedTemporaryFile(suffix=extension, delete=False)
     global_temp_clips.append(f.name)
-    r = ffmpeg_run(["-ss", str(start), "-to", str(end), "-c", "copy"], input=file, output=f.name)
+
+    frames = ffmpeg_frames(file) if isVideoClip(clip) else None
+    if frames is None:
+        # seeking on input jumps right to the cut, instead of reading through everything before it
+        ffmpeg_run(["-t", str(end - start), "-c", "copy"], input=file, output=f.name, inputOptions=["-ss", str(start)])
+    else:
+        # with stream copy, ffmpeg starts on the keyframe before the seek point
+        k = frames.nearestKeyframe(start)
+        seek = frames.keyframeSeekTime(k)
+        last = max(k + 1, frames.frameAt(end)) if end < clip.duration else len(frames)
+        for attempt in range(2):
+            # ffmpeg counts time from the seek point, and would hide everything between the keyframe and it behind an edit list. Shifted by the difference, the cut starts at zero on the keyframe
+            inputOptions = ["-ss", str(seek), "-itsoffset", str(seek - frames.seekTime(k))]
+            count = []
+            if last < len(frames):
+                # video by counting packets, as B-frames make its timestamps a poor guide to where the packets end. The sound by time, so that it ends exactly where the next cut starts
+                count = ["-frames:v", str(max(frames.order[k:last]) - frames.order[k] + 1), "-t", str(frames.clipTime(last) - frames.clipTime(k))]
+            ffmpeg_run(["-c", "copy"] + count, input=file, output=f.name, inputOptions=inputOptions)
+            # see where we actually landed
+            packets = ffmpeg_packets(f.name, count=1)
+            landed = frames.findPacket(packets[2][0][2], near=k) if (packets and packets[2]) else None
+            if (landed is None) or (landed == k) or (landed >= last):
+                break
+            k = landed
+        start = frames.clipTime(k)
+        if last < len(frames):
+            end = frames.clipTime(last)
 
     if isVideoClip(clip):
-        out = VideoFileClip(f.name)
+        out = openVideoFile(f.name)
     else:
-        out = AudioFileClip(f.name)
+        out = openAudioFile(f.name)
 
     setFilepath(out, f.name)
-    return out
+    return (out, start, end)
 
+def discardTempClip(clip):
+    """Closes a clip made by one of the ffmpeg functions above, and deletes its file."""
+    file = getFilepath(clip)
+    clip.close()
+    if file in global_temp_clips:
+        global_temp_clips.remove(file)
+        os.remove(file)
 
+def ffmpeg_split(clip, cuts):
+    """Splits the file of clip at the ascending times in cuts with stream copy. Returns a list of (clip, start, end) for the pieces, with the times they actually start and end at. Video can only be split on keyframes, so cuts move to the ones nearest to them, and cuts that end up on the same keyframe are merged."""
+    file = getFilepath(clip)
+    if file is None:
+        raise FileNotFoundError("ffmpeg_split called without an associated file.")
 
-def writeClip(clip, file, **kwargs):
+    frames = ffmpeg_frames(file) if isVideoClip(clip) else None
+    if frames is None:
+        starts = [0] + [t for t in cuts if 0 < t < clip.duration]
+    else:
+        keyframes = sorted(set([frames.nearestKeyframe(t) for t in cuts]) - set([0]))
+        starts = [0] + [frames.clipTime(k) for k in keyframes]
+
+    # every piece is cut like ffmpeg_subclip does it, which starts the timestamps on the keyframe and ends the sound where the next piece starts. The segment muxer does neither, and its pieces don't join up again. Seeking on input, each run only reads its own piece, and there may be hundreds
+    with ThreadPool(8) as pool:
+        return pool.map(lambda bounds: ffmpeg_subclip(clip, bounds[0], bounds[1]), list(zip(starts, starts[1:] + [clip.duration])))
+
+
+
+# Render profiles
+# final is what you ship, draft is for checking a merge by ear or eye. It renders fewer and smaller frames, with the fastest encoder settings.
+renderProfiles = {
+    "final" : {"preset" : "medium"},
+    "draft" : {"preset" : "ultrafast", "fps" : 15, "height" : 360, "bitrate" : "1000k"}
+}
+_renderProfile = "final"
+
+def getRenderProfile():
+    return _renderProfile
+
+def setRenderProfile(name):
+    global _renderProfile
+    if name not in renderProfiles:
+        raise ValueError("setRenderProfile: no such render profile '" + str(name) + "'")
+    _renderProfile = name
+
+def renderFps(clip, profile=None):
+    settings = renderProfiles[profile or getRenderProfile()]
+    fps = clip.fps if ("fps" in clip.__dict__ and clip.fps) else global_fps
+    return min(fps, settings.get("fps", fps))
+
+def renderProfileKwargs(clip, kwargs, profile=None, workers=1):
+    """Returns kwargs for write_videofile with the settings of a render profile applied. Uses the current profile if profile is None. workers is the number of renders running at the same time, which share the cores between their encoders."""
+    settings = renderProfiles[profile or getRenderProfile()]
+    kwargs = dict(kwargs)
+    kwargs["preset"] = settings["preset"]
+    kwargs["threads"] = max(1, (os.cpu_count() or 1) // workers)
+    kwargs["fps"] = renderFps(clip, profile)
+    if "bitrate" in settings:
+        kwargs["bitrate"] = settings["bitrate"]
+    if ("height" in settings) and (clip.h > settings["height"]):
+        # scaling in the encoder is much cheaper than resizing every frame in python. -2 keeps the width even, which x264 insists on
+        kwargs["ffmpeg_params"] = (kwargs.get("ffmpeg_params", None) or []) + ["-vf", "scale=-2:" + str(settings["height"])]
+    return kwargs
+
+def writeClip(clip, file, profile=None, workers=1, **kwargs):
     ext = getExtension(file)
     tmpfile = mktemp() + "." + ext
 
-    if ext == "mkv":
-        clip.write_videofile(tmpfile, codec="libx264", **kwargs)
-    elif isVideoClip(clip):
-        clip.write_videofile(tmpfile, **kwargs)
-    elif isAudioClip(clip):
-        clip.write_audiofile(tmpfile, **kwargs)
+    if isVideoClip(clip):
+        kwargs = renderProfileKwargs(clip, kwargs, profile, workers=workers)
+        kwargs.setdefault("audio_fps", projectFps())
+    else:
+        kwargs.setdefault("fps", projectFps())
+    if ("logger" not in kwargs) and (currentProgress() is not None):
+        kwargs["logger"] = renderLogger(clip.duration, video=isVideoClip(clip), audio=isAudioClip(clip) or ((clip.audio is not None) and (kwargs.get("audio", True) is not False)))
+
+    try:
+        if ext == "mkv":
+            clip.write_videofile(tmpfile, codec="libx264", **kwargs)
+        elif isVideoClip(clip):
+            clip.write_videofile(tmpfile, **kwargs)
+        elif isPlainMix(clip):
+            writeMix(clip, tmpfile, **kwargs)
+        elif isAudioClip(clip):
+            clip.write_audiofile(tmpfile, **kwargs)
+    except BaseException:
+        # cancelled, or ffmpeg died. Either way, don't leave half a file lying around
+        removeMoviepyTempFiles(tmpfile)
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
 
     # have to do it like this, since moviepy has a bug when you want to write to the same file that a clip is based on (causes freeze frame)
     shutil.move(tmpfile, file)
@@ -173,15 +783,25 @@ def getAudioBitrate(clip, file="", default="50000k"):
 
 def saveClip(clip, file, video_bitrate=global_video_bitrate, audio_bitrate=global_audio_bitrate):
     """Save a given clip to a file with the provided path. If file doesn't have an extension (like .wav or .mkv), a default extension will be appended to the filename, depending on wether it is an audio or video clip."""
+    job = prepareSaveClip(clip, file, video_bitrate=video_bitrate, audio_bitrate=audio_bitrate)
+    if job is None:
+        return
+    (clip, file1, kwargs) = job
+    writeClip(clip, file1, **kwargs)
+
+def prepareSaveClip(clip, file, video_bitrate=global_video_bitrate, audio_bitrate=global_audio_bitrate):
+    """Does everything saveClip does, except for the actual rendering. Returns a (clip, file, kwargs) triple that can be passed on to writeClip, or None if there is nothing left to render."""
     if not("fps" in clip.__dict__) or (clip.fps == None):
         print("Warning in saveClip: clip has no fps set. Choosing default of " + str(global_fps))
         clip = clip.with_fps(global_fps)
 
-    if clipfile := getFilepath(clip):
+    if isUnmodifiedFileClip(clip):
         # clip has a file associated with it. It's either temp, or an already existing file we don't want to touch
+        # edited copies of file clips still carry the filepath around, but they have to be rendered like any other clip
+        clipfile = getFilepath(clip)
         if clipfile not in global_temp_clips:
             printerr("warning in saveClip: Attempting to save file with write protected file path '" + clipfile + "'. Refusing to save.")
-            return
+            return None
 
         # there are many combinations here with extensions on file and clipfile. we simplify by just brutalizing the file and adding the tmpfile extension to whatever file was
         # it might still be that tmpfile had no extension. That's a bug, but oh well. No easy way of determining audio/video on clipfile, so we default to mkv
@@ -189,15 +809,12 @@ def saveClip(clip, file, video_bitrate=global_video_bitrate, audio_bitrate=globa
         file1 = ensureExtension(file + ext, default=".mkv")
         shutil.move(clipfile, file1)
         global_temp_clips.remove(clipfile)
-        return
+        return None
 
     # clip has no origin, was probably created during program execution
     if isVideoClip(clip):
         file1 = ensureExtension(file, default=".mkv")
-        writeClip(clip, file1,
-                  bitrate=video_bitrate,
-                  audio_bitrate=audio_bitrate)
-    else:
-        file1 = ensureExtension(file, ".wav")
-        writeClip(clip, file1,
-                  bitrate=audio_bitrate)
+        # the profile is fixed here, so that it ends up in the cache key, and a render started in draft mode stays a draft
+        return (clip, file1, {"bitrate" : video_bitrate, "audio_bitrate" : audio_bitrate, "profile" : getRenderProfile()})
+    file1 = ensureExtension(file, ".wav")
+    return (clip, file1, {"bitrate" : audio_bitrate})
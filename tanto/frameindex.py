@@ -0,0 +1,138 @@
+import os, re, hashlib, subprocess
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+# Frame index
+# Where the frames and keyframes of a video file are, without decoding it. Listing the packets of a long file still takes a while, so indices are kept on disk, next to the project.
+
+_indexDir = None
+_indices = {}
+
+def setFrameIndexDir(dir):
+    """Sets the directory frame indices are stored in. Without one, indices are only kept in memory."""
+    global _indexDir
+    _indexDir = dir
+
+class FrameIndex(object):
+    """Frames of the first video stream of a file. times are the presentation timestamps of all frames in seconds, sorted. keyframes are the indices into times of all keyframes. order maps each index into times to the position of that frame's packet in the file, and crcs are the checksums of the packets in file order. start is the start time of the file, which ffmpeg's -ss is relative to."""
+    def __init__(self, times, keyframes, order, crcs, start=0):
+        self.times = times
+        self.keyframes = keyframes
+        self.order = order
+        self.crcs = crcs
+        self.start = start
+
+    def __len__(self):
+        return len(self.times)
+
+    def clipTime(self, i):
+        # moviepy starts clips at their first frame
+        return self.times[i] - self.times[0]
+
+    def seekTime(self, i):
+        return self.times[i] - self.start
+
+    def frameAt(self, t):
+        """Index of the frame showing at clip time t."""
+        return max(0, bisect_right(self.times, self.times[0] + t + 0.0005) - 1)
+
+    def nearestKeyframe(self, t):
+        """Index of the keyframe closest to clip time t."""
+        i = bisect_left(self.keyframes, self.frameAt(t))
+        candidates = self.keyframes[max(0, i-1):i+1]
+        return min(candidates, key=lambda k: abs(self.clipTime(k) - t))
+
+    def keyframeSeekTime(self, k):
+        """Time to seek to with ffmpeg's input -ss for a stream copy to start on keyframe k. Which keyframe ffmpeg considers the last one before the seek point depends on the container, so we seek halfway to the following one, which leaves it the most room."""
+        following = self.nextKeyframe(k)
+        return (self.seekTime(k) + self.seekTime(following if following is not None else len(self) - 1)) / 2
+
+    def nextKeyframe(self, k):
+        """Index of the keyframe after keyframe k, or None."""
+        i = bisect_right(self.keyframes, k)
+        if i >= len(self.keyframes):
+            return None
+        return self.keyframes[i]
+
+    def findPacket(self, crc, near=0):
+        """Returns the index of the frame whose packet has checksum crc. If there is more than one, the one closest to index near."""
+        positions = [j for j in range(len(self.crcs)) if self.crcs[j] == crc]
+        if positions == []:
+            return None
+        inverse = {self.order[i] : i for i in range(len(self.order))}
+        return min([inverse[j] for j in positions], key=lambda i: abs(i - near))
+
+
+def _indexFile(key):
+    return os.path.join(_indexDir, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+def _loadIndex(key):
+    if (_indexDir is None) or not(os.path.isfile(_indexFile(key))):
+        return None
+    try:
+        with np.load(_indexFile(key)) as f:
+            return FrameIndex(f["times"].tolist(), f["keyframes"].tolist(), f["order"].tolist(), f["crcs"].tolist(), float(f["start"]))
+    except (OSError, KeyError, ValueError):
+        # broken or from an older version. we just make a new one
+        return None
+
+def _storeIndex(key, index):
+    if _indexDir is None:
+        return
+    if not(os.path.isdir(_indexDir)):
+        os.makedirs(_indexDir)
+    # write and rename, so that an interrupted write doesn't leave a broken index behind
+    tmpfile = _indexFile(key) + ".tmp.npz"
+    np.savez(tmpfile, times=np.array(index.times, dtype=float), keyframes=np.array(index.keyframes, dtype=np.int64), order=np.array(index.order, dtype=np.int64), crcs=np.array(index.crcs, dtype=np.int64), start=np.array(index.start))
+    os.replace(tmpfile, _indexFile(key))
+
+def ffmpeg_packets(file, count=None):
+    """Lists the first count packets, or all of them, of the first video stream of file with ffmpeg's framecrc muxer. Returns (timebase, start, packets), with packets being (pts, keyframe, crc) triples in file order, or None if ffmpeg failed."""
+    # framecrc lists every packet without decoding anything, so this is about as fast as reading the file
+    limit = [] if count is None else ["-frames:v", str(count)]
+    r = subprocess.run(["ffmpeg", "-hide_banner", "-i", file, "-map", "0:v:0", "-c", "copy"] + limit + ["-f", "framecrc", "-"], capture_output=True, text=True)
+    if r.returncode != 0:
+        return None
+
+    m = re.search(r"start: (-?[\d.]+)", r.stderr)
+    (timebase, packets) = parseFramecrc(r.stdout)
+    return (timebase, float(m.group(1)) if m else 0, packets)
+
+def parseFramecrc(output):
+    """Returns (timebase, packets) for the output of ffmpeg's framecrc muxer, see ffmpeg_packets."""
+    timebase = 1/1000
+    packets = []
+    for line in output.splitlines():
+        if line.startswith("#"):
+            m = re.match(r"#tb 0: (\d+)/(\d+)", line)
+            if m:
+                timebase = int(m.group(1)) / int(m.group(2))
+            continue
+        fields = [w.strip() for w in line.split(",")]
+        if len(fields) < 6:
+            continue
+        # flags are only listed if they differ from a plain keyframe
+        flags = [int(w[2:], 16) for w in fields[6:] if w.startswith("F=")]
+        packets.append((int(fields[2]), flags == [] or (flags[0] & 1) == 1, int(fields[5], 16)))
+    return (timebase, packets)
+
+def ffmpeg_frames(file):
+    """Returns the FrameIndex of file, or None if it has no video."""
+    st = os.stat(file)
+    key = (os.path.abspath(file), st.st_mtime, st.st_size)
+    if key in _indices:
+        return _indices[key]
+
+    index = _loadIndex(key)
+    if index is None:
+        r = ffmpeg_packets(file)
+        if (r is None) or (r[2] == []):
+            return None
+        (timebase, start, packets) = r
+        order = sorted(range(len(packets)), key=lambda j: packets[j][0])
+        times = [packets[j][0] * timebase for j in order]
+        keyframes = [i for i in range(len(order)) if packets[order[i]][1]]
+        index = FrameIndex(times, keyframes, order, [crc for (pts, key, crc) in packets], start)
+        _storeIndex(key, index)
+    _indices[key] = index
+    return index
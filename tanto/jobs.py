@@ -0,0 +1,114 @@
+import heapq, itertools, threading, time, traceback
+from tanto.progress import *
+
+# Background jobs
+# Anything that takes longer than a key press, like rendering, cutting with ffmpeg or speech synthesis, runs as a job. A fixed number of threads work through waiting jobs, most urgent first.
+# Jobs must not touch tracks. They return a result, and their continuation, which runs on the main thread once the job is done, puts it where it belongs.
+
+# the user is waiting for this, e.g. a cut
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+# long renders. Quick jobs go first, even if they were started later
+PRIORITY_LOW = 2
+
+class Job(object):
+    def __init__(self, name, work, cont=None, priority=PRIORITY_NORMAL):
+        """A job called name, e.g. "saving track 3", that calls work. cont is called on the main thread with the return value of work, and returns the message to speak."""
+        self.name = name
+        self.work = work
+        self.cont = cont
+        self.priority = priority
+        self.progress = Progress(name)
+        self.state = "waiting"
+        self.result = None
+        self.error = None
+        self.traceback = None
+
+    def isActive(self):
+        return self.state in ["waiting", "running"]
+
+    def cancel(self):
+        self.progress.cancel()
+
+    def describe(self):
+        w = self.name[:1].upper() + self.name[1:]
+        if self.state == "waiting":
+            return w + ": waiting."
+        if self.progress.isCancelled():
+            return w + ": cancelling."
+        return w + ": " + self.progress.describe()
+
+
+class JobScheduler(object):
+    def __init__(self, workers=4):
+        """Runs jobs on up to workers threads at once. Renders use a process per core on their own, so this is about keeping quick jobs from waiting behind them."""
+        self.workers = workers
+        self.jobs = []
+        self._queue = []
+        self._counter = itertools.count()
+        self._finished = []
+        self._cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, name, work, cont=None, priority=PRIORITY_NORMAL):
+        """Queues a new job, and returns it. See Job."""
+        job = Job(name, work, cont=cont, priority=priority)
+        with self._cond:
+            self.jobs.append(job)
+            # the counter keeps jobs of equal priority in order, and jobs themselves from being compared
+            heapq.heappush(self._queue, (priority, next(self._counter), job))
+            self._cond.notify()
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._queue == []:
+                    self._cond.wait()
+                (_, _, job) = heapq.heappop(self._queue)
+
+            if not(job.progress.isCancelled()):
+                job.state = "running"
+                job.progress.started = time.time()
+                job.progress.lastReport = job.progress.started
+                setCurrentProgress(job.progress)
+                try:
+                    job.result = job.work()
+                except RenderCancelled:
+                    pass
+                except Exception as e:
+                    job.error = e
+                    job.traceback = traceback.format_exc()
+                setCurrentProgress(None)
+
+            if job.progress.isCancelled():
+                job.state = "cancelled"
+            elif job.error is not None:
+                job.state = "failed"
+            else:
+                job.state = "done"
+            with self._cond:
+                self._finished.append(job)
+                self._cond.notify_all()
+
+    def collect(self):
+        """Returns the jobs that finished since the last call, and forgets about them. Call this from the main loop, and run their continuations there."""
+        with self._cond:
+            (finished, self._finished) = (self._finished, [])
+            self.jobs = [job for job in self.jobs if job not in finished]
+        return finished
+
+    def active(self):
+        return [job for job in self.jobs if job.isActive()]
+
+    def running(self):
+        return [job for job in self.jobs if job.state == "running"]
+
+    def shutdown(self):
+        """Cancels all jobs, and waits for the running ones to wind down."""
+        with self._cond:
+            for job in self.jobs:
+                job.cancel()
+            while any([job.isActive() for job in self.jobs]):
+                self._cond.wait()
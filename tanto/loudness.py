@@ -0,0 +1,159 @@
+import os, re, hashlib, subprocess, threading
+import numpy as np
+from tanto.pcm import PCMReader
+from tanto.overview import _sourceKey
+
+# Loudness
+# Loudness is measured as in EBU R128, by ffmpeg's ebur128 filter. It reports the momentary loudness of the last 400 milliseconds every 100 milliseconds, which are exactly the overlapping blocks the integrated loudness is gated over. We keep those per source file, so the loudness of any clip cut from it is just a matter of picking the blocks it plays.
+
+# the level tracks are normalized to unless the user says otherwise, in LUFS. -16 is what podcasts are usually mastered to
+targetLoudness = -16
+# blocks quieter than this don't count at all, and neither do blocks more than relativeGate LU below the loudness of the rest
+absoluteGate = -70
+relativeGate = -10
+# length of a block in seconds
+blockLength = 0.4
+
+_loudnessDir = None
+_curves = {}
+_lock = threading.Lock()
+
+def setLoudnessDir(dir):
+    """Sets the directory loudness measurements of source files are stored in. Without one, they are only kept in memory."""
+    global _loudnessDir
+    _loudnessDir = dir
+    if not(os.path.isdir(dir)):
+        os.makedirs(dir)
+
+def toLoudness(energy):
+    return -0.691 + 10 * np.log10(np.maximum(energy, 1e-30))
+
+def toEnergy(loudness):
+    return 10 ** ((np.asarray(loudness, dtype=float) + 0.691) / 10)
+
+def integratedLoudness(energies):
+    """Returns the gated loudness in LUFS of blocks with the given mean square energies, or None if they are all below the absolute gate."""
+    z = np.asarray(energies, dtype=float)
+    z = z[toLoudness(z) > absoluteGate]
+    if len(z) == 0:
+        return None
+    z = z[toLoudness(z) > toLoudness(z.mean()) + relativeGate]
+    return float(toLoudness(z.mean()))
+
+class LoudnessCurve(object):
+    def __init__(self, ends, momentary):
+        """The momentary loudness of a sound, in LUFS, of the blocks ending at times ends."""
+        self.ends = np.asarray(ends, dtype=float)
+        self.momentary = np.asarray(momentary, dtype=np.float32)
+
+    def energies(self, a, b, gain=1.0, envelope=None):
+        """Returns the mean square energies of the blocks that lie between a and b, with the sound scaled by gain. envelope, if given, is a further factor, as a function of the time since a."""
+        # ffmpeg times blocks by their last sample, so allow for a sample's worth of rounding
+        keep = (self.ends - blockLength >= a - 0.001) & (self.ends <= b + 0.001)
+        z = toEnergy(self.momentary[keep]) * gain**2
+        if envelope is not None:
+            # a fade is taken at the middle of each block, which is close enough for a loudness
+            z *= envelope(self.ends[keep] - blockLength / 2 - a)**2
+        return z
+
+    def integrated(self):
+        return integratedLoudness(self.energies(0, np.inf))
+
+_blockLine = re.compile(r"t:\s*([0-9.]+)\s+TARGET:.*?M:\s*(-?[0-9.]+)")
+
+def measureLoudness(inputArgs, progress=None, feed=None):
+    """Runs ebur128 over the sound ffmpeg reads with inputArgs, and returns its LoudnessCurve. progress is advanced by the seconds measured. feed, if given, is called with ffmpeg's stdin to write the sound to."""
+    p = subprocess.Popen(["ffmpeg", "-hide_banner", "-nostats", "-threads", "1"] + inputArgs + ["-vn", "-af", "ebur128=framelog=info", "-f", "null", "-"], stdin=subprocess.PIPE if feed else subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if feed is not None:
+        writer = threading.Thread(target=lambda: _feed(feed, p.stdin), daemon=True)
+        writer.start()
+    (ends, momentary) = ([], [])
+    try:
+        for line in p.stderr:
+            m = _blockLine.search(line.decode("utf-8", "replace"))
+            if m is None:
+                continue
+            ends.append(float(m.group(1)))
+            momentary.append(float(m.group(2)))
+            if progress is not None:
+                progress.check()
+                progress.advance(0.1)
+        p.wait()
+    finally:
+        if p.poll() is None:
+            p.kill()
+            p.wait()
+    if p.returncode != 0:
+        raise RuntimeError("ffmpeg could not measure loudness.")
+    return LoudnessCurve(ends, momentary)
+
+def _feed(feed, stdin):
+    try:
+        feed(stdin)
+    except BrokenPipeError:
+        # ffmpeg was stopped, e.g. because the job was cancelled
+        pass
+    finally:
+        # ffmpeg waits for more until stdin is closed, even if feed failed
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+def _curveFile(key):
+    return os.path.join(_loudnessDir, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+def _loadCurve(key):
+    if (_loudnessDir is None) or not(os.path.isfile(_curveFile(key))):
+        return None
+    try:
+        with np.load(_curveFile(key)) as f:
+            return LoudnessCurve(f["ends"], f["momentary"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _storeCurve(key, curve):
+    if _loudnessDir is None:
+        return
+    tmpfile = _curveFile(key) + ".tmp.npz"
+    np.savez(tmpfile, ends=curve.ends, momentary=curve.momentary)
+    os.replace(tmpfile, _curveFile(key))
+
+def sourceKey(reader):
+    """Returns the key loudness of the file an audio reader reads is kept under, or None if the file went away."""
+    try:
+        return _sourceKey(reader.filename)
+    except OSError:
+        return None
+
+def knownCurve(reader):
+    """Returns the LoudnessCurve of the file reader reads if it was measured before, else None."""
+    key = sourceKey(reader)
+    if key is None:
+        return None
+    with _lock:
+        if key in _curves:
+            return _curves[key]
+    curve = _loadCurve(key)
+    if curve is not None:
+        with _lock:
+            _curves[key] = curve
+    return curve
+
+def sourceCurve(reader, progress=None):
+    """Returns the LoudnessCurve of the file an audio reader reads, measuring it if it wasn't before."""
+    curve = knownCurve(reader)
+    if curve is not None:
+        return curve
+    if isinstance(reader, PCMReader) and reader.isReady():
+        # the decoded samples are much quicker to go through than the file
+        inputArgs = ["-f", "f32le", "-ar", str(reader.fps), "-ac", str(reader.nchannels), "-i", reader.file]
+    else:
+        inputArgs = ["-i", reader.filename]
+    curve = measureLoudness(inputArgs, progress=progress)
+    key = sourceKey(reader)
+    if key is not None:
+        _storeCurve(key, curve)
+        with _lock:
+            _curves[key] = curve
+    return curve
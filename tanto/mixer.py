@@ -0,0 +1,202 @@
+import os, subprocess
+from bisect import bisect_right
+import numpy as np
+from moviepy.audio.AudioClip import AudioClip
+from moviepy.video.VideoClip import VideoClip
+from tanto.progress import *
+from tanto.synth import *
+from tanto.pcm import projectFps
+
+# Mixing audio
+# moviepy's CompositeAudioClip asks every one of its clips for every chunk, even though most of them are silent most of the time. A merged podcast with dozens of inserts spends its time checking clips that don't play.
+# The mixer lays all clips out on one timeline instead. For each block of samples, it picks the clips overlapping the block with a single vectorized comparison, and only adds up the samples where they actually play.
+
+# how long ducking under a linked track takes to set in before it starts, and to wear off after it ends, in seconds. Hard steps click
+duckAttack = 0.05
+duckRelease = 0.15
+
+class Envelope(object):
+    def __init__(self, times=[], gains=[]):
+        """A gain curve through the points (times[i], gains[i]), linear in between, and constant before the first and after the last point. Times must be ascending. Without points, the gain is 1 throughout."""
+        self.times = np.asarray(times, dtype=float)
+        self.gains = np.asarray(gains, dtype=float)
+
+    def __call__(self, t):
+        if len(self.times) == 0:
+            return np.ones(np.shape(t))
+        return np.interp(t, self.times, self.gains)
+
+    def __mul__(self, other):
+        # exact at every point of both, and linear in between. The product of two ramps isn't quite linear, but ramps are short
+        times = np.union1d(self.times, other.times)
+        return Envelope(times, self(times) * other(times))
+
+    def isFlat(self):
+        return np.all(self.gains == 1)
+
+def duckingEnvelope(suppressions, attack=None, release=None):
+    """Returns the Envelope for a list of (factor, start, end) suppressions. The gain ramps down to factor over attack seconds before start, and back up over release seconds after end. Overlapping suppressions multiply."""
+    attack = duckAttack if attack is None else attack
+    release = duckRelease if release is None else release
+    env = Envelope()
+    for (factor, start, end) in suppressions:
+        env = env * Envelope([start - attack, start, end, end + release], [1, factor, factor, 1])
+    return env
+
+def fadeEnvelope(duration, fadeIn=0, fadeOut=0):
+    """Returns the Envelope of a clip of given duration that fades in from silence over the first fadeIn seconds, and out over the last fadeOut seconds."""
+    env = Envelope()
+    if fadeIn > 0:
+        env = env * Envelope([0, fadeIn], [0, 1])
+    if fadeOut > 0:
+        env = env * Envelope([duration - fadeOut, duration], [1, 0])
+    return env
+
+def crossfadeStarts(durations, fade=0):
+    """Returns (starts, fade) for clips of the given durations played one after another, each overlapping the one before by fade seconds. fade is shortened if a clip is too short to fade both in and out."""
+    fade = min([fade] + [d / 2 for d in durations]) if len(durations) > 1 else 0
+    starts = np.cumsum([0] + list(durations[:-1])) - fade * np.arange(len(durations))
+    return (starts.tolist(), fade)
+
+def crossfadeEnvelopes(durations, fade):
+    """Returns the Envelope of each of the clips laid out by crossfadeStarts. The first clip doesn't fade in, and the last doesn't fade out."""
+    n = len(durations)
+    return [fadeEnvelope(d, fadeIn=fade if i > 0 else 0, fadeOut=fade if i < n - 1 else 0) for (i, d) in enumerate(durations)]
+
+class SequenceVideoClip(VideoClip):
+    def __init__(self, clips, fade=0):
+        """Plays video clips of the same size one after another, each fading into the next over fade seconds. The fade shapes are the envelopes the sound of the clips is mixed with, so picture and sound fade alike."""
+        durations = [clip.duration for clip in clips]
+        (self.starts, self.fade) = crossfadeStarts(durations, fade)
+        self.clips = clips
+        self.envelopes = crossfadeEnvelopes(durations, self.fade)
+        self._batch = None
+        VideoClip.__init__(self, make_frame=self.frameAt, duration=self.starts[-1] + durations[-1])
+        fps = [clip.fps for clip in clips if getattr(clip, "fps", None)]
+        self.fps = max(fps) if fps else None
+
+    def frameAt(self, t):
+        i = min(max(0, bisect_right(self.starts, t) - 1), len(self.clips) - 1)
+        local = min(t - self.starts[i], self.clips[i].duration)
+        if (i == 0) or (local >= self.fade):
+            return self.clips[i].get_frame(local)
+        # still fading in over the end of the clip before. One blend over the whole frame, rather than a mask per clip
+        (before, alphas) = self._fadeBatch(i)
+        frame = self.clips[i].get_frame(local)
+        k = min(len(before) - 1, int(round(local * (self.fps or 25))))
+        return (before[k] + alphas[k] * (frame - before[k].astype(np.float32))).astype(np.uint8)
+
+    def _fadeBatch(self, i):
+        # the end of the clip before clip i, and the alpha ramp over it, all at once when the fade starts. Clips cut from the same file share a reader, which would otherwise seek back and forth for every frame of the fade
+        if (self._batch is None) or (self._batch[0] != i):
+            fps = self.fps or 25
+            times = np.arange(int(np.ceil(self.fade * fps))) / fps
+            offset = self.starts[i] - self.starts[i - 1]
+            before = np.array([self.clips[i - 1].get_frame(offset + x) for x in times])
+            self._batch = (i, before, self.envelopes[i](times).astype(np.float32)[:, None, None])
+        return self._batch[1:]
+
+class MixedAudioClip(AudioClip):
+    def __init__(self, clips, fps=None, suppressions=[], overlays=[]):
+        """Mixes audio clips, each playing from its own start time. Instead of a clip, there may be a (clip, envelope) pair, with an Envelope in the clip's own time, e.g. for fades. suppressions is a list of (factor, start, end) triples that scale the volume of clips between start and end, see duckingEnvelope. overlays are clips mixed on top of that, without being suppressed. fps defaults to the highest of the clips, which is the project sample rate unless something went around the import."""
+        clips = [_withEnvelope(clip) for clip in clips if clip is not None]
+        overlays = [_withEnvelope(clip) for clip in overlays if clip is not None]
+        everything = [clip for (clip, env) in clips + overlays]
+        if fps is None:
+            fps = max([getattr(clip, "fps", None) or 0 for clip in everything] + [0]) or projectFps()
+        self.nchannels = max([getattr(clip, "nchannels", None) or 1 for clip in everything] + [1])
+        ends = [end for layer in [_layout(clips), _layout(overlays)] for end in layer[1].tolist()]
+        # silence still makes the mix longer, but there's nothing to add up
+        self.layers = [_layout([(clip, env) for (clip, env) in entries if not(isSilent(clip))]) for entries in [clips, overlays]]
+        # all suppressions in one curve, so that ducking under 30 voice overs costs the same as under one
+        self.envelope = duckingEnvelope(suppressions)
+        AudioClip.__init__(self, make_frame=self.mix, duration=max(ends + [0]), fps=fps)
+
+    def mix(self, t):
+        """Returns the samples at times t, which have to be in ascending order, as moviepy's chunks are."""
+        if np.isscalar(t):
+            return self.mix(np.array([t]))[0]
+        t = np.asarray(t, dtype=float)
+        n = len(t)
+        out = np.zeros((n, self.nchannels))
+        if n == 0:
+            return out
+
+        for layer in range(len(self.layers)):
+            (starts, ends, clips, envelopes) = self.layers[layer]
+            acc = np.zeros((n, self.nchannels))
+            for i in np.nonzero((starts <= t[-1]) & (ends > t[0]))[0]:
+                a = np.searchsorted(t, starts[i])
+                b = np.searchsorted(t, ends[i])
+                if b <= a:
+                    continue
+                frame = self._channels(clips[i].get_frame(t[a:b] - starts[i]), b - a)
+                if envelopes[i] is not None:
+                    frame *= envelopes[i](t[a:b] - starts[i])[:, None]
+                acc[a:b] += frame
+
+            if (layer == 0) and not(self.envelope.isFlat()):
+                acc *= self.envelope(t)[:, None]
+            out += acc
+        return out
+
+    def mixSamples(self, first, n):
+        """Returns n samples at the clip's fps, starting with sample number first."""
+        return self.mix((first + np.arange(n)) / self.fps)
+
+    def _channels(self, frame, n):
+        # a copy, as the envelope is applied in place, and readers may hand out their buffer
+        frame = np.array(frame, dtype=float).reshape((n, -1))
+        if frame.shape[1] == self.nchannels:
+            return frame
+        if frame.shape[1] == 1:
+            return np.repeat(frame, self.nchannels, axis=1)
+        if frame.shape[1] > self.nchannels:
+            return frame[:, :self.nchannels]
+        # fewer channels than the mix, but more than one. The missing ones stay silent
+        return np.pad(frame, ((0, 0), (0, self.nchannels - frame.shape[1])))
+
+def _withEnvelope(entry):
+    if isinstance(entry, tuple):
+        (clip, env) = entry
+        return (clip, None if env.isFlat() else env)
+    return (entry, None)
+
+def _layout(entries):
+    # (starts, ends, clips, envelopes), with the arrays for picking overlapping clips in one go
+    clips = [clip for (clip, env) in entries]
+    starts = np.array([clip.start or 0 for clip in clips], dtype=float)
+    ends = np.array([(clip.start or 0) + (clip.duration if clip.duration is not None else np.inf) for clip in clips], dtype=float)
+    return (starts, ends, clips, [env for (clip, env) in entries])
+
+
+def isPlainMix(clip):
+    # fx applied to a mix keep its class, but wrap its frame function. Those have to go through moviepy
+    return isinstance(clip, MixedAudioClip) and (getattr(clip.make_frame, "__func__", None) is MixedAudioClip.mix)
+
+def writeMix(clip, file, fps=None, bitrate=None, blocksize=1.0, **kwargs):
+    """Writes a MixedAudioClip to file, mixing blocksize seconds at a time and piping the samples straight into an ffmpeg encoder. Other keyword arguments of write_audiofile are ignored. Reports to the current progress, if any."""
+    mix = clip.make_frame.__self__
+    fps = fps or clip.fps
+    ext = os.path.splitext(file)[1].lower()
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "f32le", "-ar", str(mix.fps), "-ac", str(mix.nchannels), "-i", "-", "-ar", str(fps)]
+    if bitrate and (ext != ".wav"):
+        cmd += ["-b:a", str(bitrate)]
+    p = subprocess.Popen(cmd + [file], stdin=subprocess.PIPE)
+
+    total = int(round(clip.duration * mix.fps))
+    block = max(1, int(blocksize * mix.fps))
+    try:
+        for first in range(0, total, block):
+            checkCancelled()
+            n = min(block, total - first)
+            samples = mix.mixSamples(first, n)
+            p.stdin.write(np.clip(samples, -1, 1).astype("<f4").tobytes())
+            reportProgress(n / mix.fps)
+        p.stdin.close()
+    except BaseException:
+        p.kill()
+        p.wait()
+        raise
+    if p.wait() != 0:
+        raise RuntimeError("writeMix: ffmpeg failed to write " + file)
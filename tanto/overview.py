@@ -0,0 +1,215 @@
+import os, hashlib, subprocess, threading, queue
+from bisect import bisect_left, bisect_right
+import numpy as np
+from tanto.pcm import PCMReader
+
+# Sound overviews
+# Sighted editors glance at a waveform to find the next pause. An overview is that waveform in numbers: the peak and RMS level of every hundredth of a second of a source file, computed once in the background and kept with the project.
+# Pauses and loud onsets are worked out when an overview is made, so navigating by them is just a binary search.
+
+# blocks per second
+blockRate = 100
+# RMS level in dBFS below which sound counts as silence, and how long it has to last to be a pause, in seconds
+silenceLevel = -45
+minSilence = 0.3
+# a loud onset is where the level rises above onsetLevel after staying below it for at least minQuiet seconds
+onsetLevel = -25
+minQuiet = 0.2
+
+_overviewDir = None
+_overviews = {}
+_queued = set()
+_pending = queue.Queue()
+_worker = None
+
+def setOverviewDir(dir):
+    """Sets the directory overviews of source files are stored in. Without one, overviews are only kept in memory."""
+    global _overviewDir
+    _overviewDir = dir
+    if not(os.path.isdir(dir)):
+        os.makedirs(dir)
+
+def toDecibels(x):
+    # -120 dB for digital silence, rather than minus infinity
+    return 20 * np.log10(np.maximum(x, 1e-6))
+
+class Overview(object):
+    def __init__(self, peaks, rms):
+        """Levels of a sound in blocks of 1/blockRate seconds. peaks and rms are the linear amplitudes of the blocks."""
+        self.peaks = np.asarray(peaks, dtype=np.float32)
+        self.rms = np.asarray(rms, dtype=np.float32)
+        db = toDecibels(self.rms)
+        (self.silenceStarts, self.silenceEnds) = _runs(db < silenceLevel, minSilence)
+        (quietStarts, quietEnds) = _runs(db < onsetLevel, minQuiet)
+        # a quiet stretch that runs until the end isn't followed by anything loud
+        self.onsets = [t for t in quietEnds if t < self.duration()]
+
+    def __len__(self):
+        return len(self.rms)
+
+    def duration(self):
+        return len(self) / blockRate
+
+    def blocks(self, a, b):
+        """Returns (peaks, rms) of blocks a to b, padded with silence past the end."""
+        n = max(0, b - a)
+        (peaks, rms) = (self.peaks[max(0, a):max(0, b)], self.rms[max(0, a):max(0, b)])
+        if len(peaks) < n:
+            (peaks, rms) = (np.pad(peaks, (0, n - len(peaks))), np.pad(rms, (0, n - len(rms))))
+        return (peaks, rms)
+
+    def levelAt(self, t, window=0.1):
+        """Returns (peak, rms) in dBFS of the window seconds starting at t."""
+        a = min(max(0, int(t * blockRate)), max(0, len(self) - 1))
+        b = max(a + 1, a + int(window * blockRate))
+        (peaks, rms) = (self.peaks[a:b], self.rms[a:b])
+        if len(peaks) == 0:
+            return (float(toDecibels(0)), float(toDecibels(0)))
+        return (float(toDecibels(peaks.max())), float(toDecibels(np.sqrt(np.mean(rms**2)))))
+
+    def silences(self, level=None, minLength=None):
+        """Returns (start, end) of all pauses, i.e. stretches of at least minLength seconds with an RMS level below level in dBFS. Both default to silenceLevel and minSilence."""
+        if (level is None) and (minLength is None):
+            return list(zip(self.silenceStarts, self.silenceEnds))
+        level = silenceLevel if level is None else level
+        minLength = minSilence if minLength is None else minLength
+        return list(zip(*_runs(toDecibels(self.rms) < level, minLength)))
+
+    def nextSilence(self, t):
+        """Returns (start, end) of the first pause starting after t, or None."""
+        i = bisect_right(self.silenceStarts, t + 1/blockRate)
+        if i >= len(self.silenceStarts):
+            return None
+        return (self.silenceStarts[i], self.silenceEnds[i])
+
+    def previousSilence(self, t):
+        """Returns (start, end) of the last pause starting before t, or None."""
+        i = bisect_left(self.silenceStarts, t - 1/blockRate) - 1
+        if i < 0:
+            return None
+        return (self.silenceStarts[i], self.silenceEnds[i])
+
+    def nextOnset(self, t):
+        i = bisect_right(self.onsets, t + 1/blockRate)
+        if i >= len(self.onsets):
+            return None
+        return self.onsets[i]
+
+    def previousOnset(self, t):
+        i = bisect_left(self.onsets, t - 1/blockRate) - 1
+        if i < 0:
+            return None
+        return self.onsets[i]
+
+def _runs(mask, minLength):
+    # (starts, ends) in seconds of the stretches where mask holds for at least minLength seconds
+    d = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    (starts, ends) = (np.nonzero(d == 1)[0], np.nonzero(d == -1)[0])
+    keep = (ends - starts) >= minLength * blockRate
+    return ((starts[keep] / blockRate).tolist(), (ends[keep] / blockRate).tolist())
+
+def makeOverview(read, fps, duration, chunk=1000):
+    """Computes the Overview of a sound of given duration with fps samples per second. read(a, b) returns samples a to b as an array with a row per sample, and may return fewer at the end. Samples are read chunk blocks at a time."""
+    nblocks = int(np.ceil(duration * blockRate))
+    # blocks don't have to be a whole number of samples long
+    bounds = np.round(np.arange(nblocks + 1) * fps / blockRate).astype(np.int64)
+    (peaks, rms) = ([], [])
+    for first in range(0, nblocks, chunk):
+        last = min(nblocks, first + chunk)
+        n = bounds[last] - bounds[first]
+        x = np.asarray(read(bounds[first], bounds[last]), dtype=np.float32)
+        if x.ndim == 1:
+            x = x[:, None]
+        if len(x) < n:
+            x = np.vstack([x[:n], np.zeros((n - len(x), max(1, x.shape[1])), dtype=np.float32)])
+        starts = bounds[first:last] - bounds[first]
+        peaks.append(np.maximum.reduceat(np.abs(x).max(axis=1), starts))
+        rms.append(np.sqrt(np.add.reduceat((x**2).mean(axis=1), starts) / np.diff(bounds[first:last+1])))
+    if peaks == []:
+        return Overview([], [])
+    return Overview(np.concatenate(peaks), np.concatenate(rms))
+
+
+def _sourceKey(file):
+    st = os.stat(file)
+    return (os.path.abspath(file), st.st_mtime, st.st_size)
+
+def _overviewFile(key):
+    return os.path.join(_overviewDir, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+def _loadOverview(key):
+    if (_overviewDir is None) or not(os.path.isfile(_overviewFile(key))):
+        return None
+    try:
+        with np.load(_overviewFile(key)) as f:
+            return Overview(f["peaks"], f["rms"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _storeOverview(key, overview):
+    if _overviewDir is None:
+        return
+    # write and rename, so that an interrupted write doesn't leave a broken overview behind
+    tmpfile = _overviewFile(key) + ".tmp.npz"
+    np.savez(tmpfile, peaks=overview.peaks, rms=overview.rms)
+    os.replace(tmpfile, _overviewFile(key))
+
+def _decodeOverview(reader):
+    p = subprocess.Popen(["ffmpeg", "-loglevel", "error", "-i", reader.filename, "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(reader.fps), "-ac", str(reader.nchannels), "-"], stdout=subprocess.PIPE)
+    def read(a, b):
+        # always called in order, so this just reads the next samples off the pipe
+        data = p.stdout.read((b - a) * reader.nchannels * 4)
+        return np.frombuffer(data[:len(data) // (4 * reader.nchannels) * 4 * reader.nchannels], dtype="<f4").reshape((-1, reader.nchannels))
+    try:
+        return makeOverview(read, reader.fps, reader.duration)
+    finally:
+        p.stdout.close()
+        p.kill()
+        p.wait()
+
+def _buildSourceOverview(key, reader):
+    overview = _loadOverview(key)
+    if overview is None:
+        if isinstance(reader, PCMReader):
+            # going through the decoded samples is much quicker than decoding the file a second time
+            reader.settled.wait()
+        if isinstance(reader, PCMReader) and reader.isReady():
+            samples = reader.samples
+            overview = makeOverview(lambda a, b: samples[a:b], reader.fps, len(samples) / reader.fps)
+        else:
+            overview = _decodeOverview(reader)
+        _storeOverview(key, overview)
+    _overviews[key] = overview
+
+def _run():
+    while True:
+        (key, build) = _pending.get()
+        try:
+            build()
+        except Exception:
+            # the file went away, or can't be decoded. It just doesn't get an overview
+            pass
+        _queued.discard(key)
+
+def scheduleOverview(key, build):
+    """Calls build on the overview thread, unless it is still waiting to build key already."""
+    global _worker
+    if key in _queued:
+        return
+    _queued.add(key)
+    # one at a time, in the order they were asked for
+    if _worker is None:
+        _worker = threading.Thread(target=_run, daemon=True)
+        _worker.start()
+    _pending.put((key, build))
+
+def sourceOverview(reader):
+    """Returns the Overview of the file an audio reader reads, or None if it isn't ready yet. It is then made in the background, so asking again later will do."""
+    try:
+        key = _sourceKey(reader.filename)
+    except OSError:
+        return None
+    if key in _overviews:
+        return _overviews[key]
+    scheduleOverview(key, lambda: _buildSourceOverview(key, reader))
+    return None
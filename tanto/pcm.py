@@ -0,0 +1,186 @@
+import os, glob, hashlib, subprocess, threading, queue
+import numpy as np
+from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.video.io.VideoFileClip import VideoFileClip
+from moviepy.audio.io.readers import FFMPEG_AudioReader
+
+# Decoded audio
+# moviepy reads audio through an ffmpeg pipe, and every read outside its buffer restarts the decoder. Scrubbing back and forth over the same few seconds, which is most of what editing by ear is, pays for that every single time.
+# Instead, every audio source is decoded once, in the background, to a raw float32 file in the project. After that, reads come straight out of a memory map.
+
+# Project audio format
+# All sound is brought to the project's sample rate as it is read in, and decoded into the cache that way, so mixing, playing and writing never resample anything. moviepy reads every file as stereo, so everything else is stereo too.
+_projectFps = 44100
+projectChannels = 2
+
+def setProjectFps(fps):
+    global _projectFps
+    _projectFps = fps
+
+def projectFps():
+    return _projectFps
+
+# Reading files
+# A moviepy reader is one ffmpeg process and a position in it, and two threads reading from it at once get each other's frames, or kill each other's process. The player, its read ahead, jobs and overviews all read clips, so every file reader goes through this one lock.
+# It is reentrant, so that the player can hold it over a whole read of a clip that is made of several files.
+readerLock = threading.RLock()
+
+def _resetReaderLock():
+    # the child of a fork only has the thread that forked. Whoever held the lock in the parent isn't there to let go of it
+    global readerLock
+    readerLock = threading.RLock()
+
+# renders fork worker processes from job threads, while the player may be reading. Waiting for the lock first means no reader is ever forked halfway through a read, and the workers start out with a lock of their own
+os.register_at_fork(before=lambda: readerLock.acquire(), after_in_parent=lambda: readerLock.release(), after_in_child=_resetReaderLock)
+
+def lockReader(reader):
+    get_frame = reader.get_frame
+    def lockedGetFrame(t):
+        with readerLock:
+            return get_frame(t)
+    reader.get_frame = lockedGetFrame
+
+def openAudioFile(file):
+    clip = AudioFileClip(file, fps=projectFps())
+    lockReader(clip.reader)
+    return clip
+
+def openVideoFile(file):
+    clip = VideoFileClip(file, audio_fps=projectFps())
+    lockReader(clip.reader)
+    if clip.audio is not None:
+        lockReader(clip.audio.reader)
+    return clip
+
+
+_pcmDir = None
+_pcmMaxBytes = 4 * 1024**3
+_pending = queue.Queue()
+_decoder = None
+
+def setPCMCacheDir(dir, maxBytes=None):
+    """Sets the directory decoded audio is kept in, and how large it may grow. Without one, audio is read from the files directly."""
+    global _pcmDir, _pcmMaxBytes
+    _pcmDir = dir
+    if maxBytes is not None:
+        _pcmMaxBytes = maxBytes
+    if not(os.path.isdir(dir)):
+        os.makedirs(dir)
+    # left over from decodes that were interrupted by quitting
+    for file in glob.glob(os.path.join(dir, "*.part")):
+        os.remove(file)
+
+class PCMReader(object):
+    def __init__(self, reader, file):
+        """Stands in for the FFMPEG_AudioReader reader of a clip. Until file, the decoded audio, is ready, frames come from reader."""
+        self.fallback = reader
+        self.file = file
+        self.samples = None
+        # set once decoding is over, whether it worked or not
+        self.settled = threading.Event()
+
+    def __getattr__(self, name):
+        # fps, nchannels, duration and the like
+        if name in ["fallback", "file", "samples", "settled"]:
+            raise AttributeError(name)
+        return getattr(self.fallback, name)
+
+    def isReady(self):
+        return self.samples is not None
+
+    def load(self):
+        n = os.path.getsize(self.file) // (4 * self.fallback.nchannels)
+        self.samples = np.memmap(self.file, dtype="<f4", mode="r", shape=(n, self.fallback.nchannels))
+        self.settled.set()
+        # recently used files are the last to be evicted
+        os.utime(self.file)
+
+    def get_frame(self, tt):
+        samples = self.samples
+        if samples is None:
+            return self.fallback.get_frame(tt)
+
+        if isinstance(tt, np.ndarray):
+            # rounded like moviepy's reader does, so that switching over doesn't shift anything
+            frames = np.round(self.fallback.fps * tt).astype(int)
+            inTime = (tt >= 0) & (frames >= 0) & (frames < len(samples))
+            result = np.zeros((len(tt), self.fallback.nchannels))
+            result[inTime] = samples[frames[inTime]]
+            return result
+
+        i = int(self.fallback.fps * tt)
+        if (i < 0) or (i >= len(samples)):
+            return np.zeros(self.fallback.nchannels)
+        return np.array(samples[i], dtype=float)
+
+    def close(self):
+        self.samples = None
+        self.fallback.close()
+
+
+def pcmFile(source, fps, nchannels):
+    """Returns the file the decoded audio of source is cached in, whether it exists yet or not."""
+    st = os.stat(source)
+    key = (os.path.abspath(source), st.st_mtime, st.st_size, fps, nchannels)
+    return os.path.join(_pcmDir, hashlib.sha1(repr(key).encode()).hexdigest() + ".f32")
+
+def decodePCM(source, fps, nchannels, file):
+    # written under another name and renamed, so that a half decoded file is never mistaken for a whole one
+    tmpfile = file + ".part"
+    r = subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", source, "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(fps), "-ac", str(nchannels), tmpfile])
+    if r.returncode != 0:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        return False
+    os.replace(tmpfile, file)
+    return True
+
+def evictPCM():
+    files = sorted(glob.glob(os.path.join(_pcmDir, "*.f32")), key=os.path.getmtime)
+    total = sum([os.path.getsize(file) for file in files])
+    # the newest one stays, even if it's larger than the whole cache
+    while (len(files) > 1) and (total > _pcmMaxBytes):
+        file = files.pop(0)
+        total -= os.path.getsize(file)
+        try:
+            # clips that have the file mapped keep reading from it
+            os.remove(file)
+        except OSError:
+            pass
+
+def _decodeLoop():
+    while True:
+        reader = _pending.get()
+        try:
+            if not(os.path.isfile(reader.file)):
+                if not(decodePCM(reader.fallback.filename, reader.fallback.fps, reader.fallback.nchannels, reader.file)):
+                    continue
+                evictPCM()
+            reader.load()
+        except OSError:
+            # the source went away, or the disk is full. The clip just keeps reading from ffmpeg
+            pass
+        finally:
+            reader.settled.set()
+
+def usePCMCache(clip):
+    """Makes the sound of a file clip read from the decoded audio cache. Does nothing if no cache directory is set, or if clip doesn't get its sound from a file."""
+    global _decoder
+    audio = clip if isinstance(clip, AudioFileClip) else getattr(clip, "audio", None)
+    if (_pcmDir is None) or not(isinstance(audio, AudioFileClip)) or not(isinstance(audio.reader, FFMPEG_AudioReader)):
+        return
+    try:
+        reader = PCMReader(audio.reader, pcmFile(audio.reader.filename, audio.reader.fps, audio.reader.nchannels))
+    except OSError:
+        return
+    # copies of the clip, like its subclips, read through the original's reader too
+    audio.reader = reader
+    if os.path.isfile(reader.file):
+        reader.load()
+        return
+
+    # one file at a time, so that opening a project doesn't start an ffmpeg for every file in it
+    if _decoder is None:
+        _decoder = threading.Thread(target=_decodeLoop, daemon=True)
+        _decoder.start()
+    _pending.put(reader)
@@ -0,0 +1,377 @@
+import threading, collections
+import numpy as np
+import sounddevice as sd
+from tanto.pcm import projectFps, projectChannels, readerLock
+
+# Playback
+# One output stream is opened when the program starts and stays open. Its callback only copies samples out of a ring buffer, or plays silence if there is nothing to play.
+# A prefetch thread keeps the ring buffer topped up from the clip being played, which for sound that was imported is just reading the decoded samples of the PCM cache. Starting, stopping and seeking swap what the buffer is filled with, and never touch the stream.
+
+# samples the stream asks for at a time. Smaller is quicker to react, but has to be refilled more often
+blockSize = 512
+# how far the prefetcher reads ahead, in seconds, and how much it reads at a time. The first read after starting is short, so that sound starts right away
+bufferLength = 1.0
+prefetchLength = 0.1
+firstPrefetchLength = 0.01
+# seeking while playing fades from the old position to the new one over this many seconds, instead of cutting, which clicks
+seekFadeLength = 0.005
+# regions up to this many seconds long are kept in memory as they are played, for replaying them, see Region
+maxRegionLength = 30
+# after moving around, the first seconds of the clips likely to be played next are read into memory ahead of time, up to this many bytes for all of them
+warmLength = 3.0
+warmMaxBytes = 32 * 1024**2
+
+class RingBuffer(object):
+    def __init__(self, frames, nchannels):
+        """A buffer of up to frames samples with nchannels channels each, written by one thread and read by another."""
+        self.data = np.zeros((frames, nchannels), dtype=np.float32)
+        # counters of all samples ever written and read. Only the writer moves written, and only the reader moves read, so neither needs a lock
+        self.written = 0
+        self.read = 0
+        # clearing is left to the reader, which skips everything written before this
+        self.cleared = 0
+
+    def available(self):
+        return max(0, self.written - max(self.read, self.cleared))
+
+    def space(self):
+        return len(self.data) - (self.written - self.read)
+
+    def clear(self):
+        """Drops everything in the buffer, and returns the counter of the next sample to be written."""
+        self.cleared = self.written
+        return self.cleared
+
+    def write(self, frames):
+        """Appends as many of frames as fit, and returns how many that was."""
+        n = min(len(frames), self.space())
+        a = self.written % len(self.data)
+        first = min(n, len(self.data) - a)
+        self.data[a:a+first] = frames[:first]
+        self.data[:n-first] = frames[first:n]
+        self.written += n
+        return n
+
+    def peek(self, counter, n):
+        """Returns the n samples starting at counter, as far as they were written, and silence after that."""
+        out = np.zeros((n, self.data.shape[1]), dtype=np.float32)
+        m = max(0, min(n, self.written - counter))
+        a = counter % len(self.data)
+        first = min(m, len(self.data) - a)
+        out[:first] = self.data[a:a+first]
+        out[first:m] = self.data[:m-first]
+        return out
+
+    def rewind(self, counter):
+        """Forgets what was written from counter on, so it can be written again, and returns where writing goes on. Only the writer may call this. If the reader got past counter in the meantime, that is where it goes on instead."""
+        self.written = max(counter, self.read)
+        return self.written
+
+    def readInto(self, out):
+        """Fills out with the oldest samples in the buffer, and returns how many there were. The rest of out is left alone."""
+        self.read = max(self.read, self.cleared)
+        # never less than nothing, even if the writer just rewound behind us
+        n = max(0, min(len(out), self.written - self.read))
+        a = self.read % len(self.data)
+        first = min(n, len(self.data) - a)
+        out[:first] = self.data[a:a+first]
+        out[first:n] = self.data[:n-first]
+        self.read += n
+        return n
+
+class Region(object):
+    def __init__(self, clip, a, b, fps=None):
+        """The sound of clip from a to b seconds, kept in memory once it was played, so that it can be played over and over without going back to clip. The edges fade in and out a little, so that looping doesn't click."""
+        self.fps = fps or projectFps()
+        (self.clip, self.a, self.b) = (clip, a, b)
+        n = max(0, int(round((b - a) * self.fps)))
+        # nothing is read here. The first time around, the prefetcher reads the region like any other clip, under the read lock, and playing starts right away
+        self.samples = None
+        self.filled = np.zeros(n, dtype=bool)
+        self.fade = min(n // 2, int(seekFadeLength * self.fps))
+        self.duration = n / self.fps
+
+    def isOf(self, clip, a, b):
+        return (clip is self.clip) and (a == self.a) and (b == self.b)
+
+    def get_frame(self, t):
+        n = len(self.filled)
+        i = np.clip(np.round(np.asarray(t) * self.fps).astype(np.int64), 0, max(0, n - 1))
+        missing = np.atleast_1d(i)[~self.filled[np.atleast_1d(i)]]
+        if len(missing) > 0:
+            self._fill(missing.min(), missing.max() + 1)
+        return self.samples[i]
+
+    def _fill(self, first, end):
+        frames = np.asarray(self.clip.get_frame(self.a + np.arange(first, end) / self.fps), dtype=np.float32).reshape((end - first, -1))
+        if self.samples is None:
+            self.samples = np.zeros((len(self.filled), frames.shape[1]), dtype=np.float32)
+        if self.fade > 0:
+            k = np.arange(first, end)
+            frames *= np.minimum(1, np.minimum(k, len(self.filled) - 1 - k) / self.fade).astype(np.float32)[:, None]
+        self.samples[first:end] = frames
+        self.filled[first:end] = True
+
+class WarmCache(object):
+    def __init__(self, maxBytes):
+        """Samples of clips read ahead of time, one run of them per clip, up to maxBytes for all of them. The least recently used go first. Runs are never changed once they are in, so they can be handed out without holding the lock."""
+        self.maxBytes = maxBytes
+        # id(clip) -> (clip, first, frames). The clip is kept so that its id can't be reused while it's in here
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, clip, first, n):
+        """Returns the n samples of clip starting at sample first if they are all in here, else None."""
+        with self.lock:
+            entry = self.entries.get(id(clip))
+            if (entry is None) or (entry[0] is not clip):
+                return None
+            self.entries.move_to_end(id(clip))
+        (_, a, frames) = entry
+        if (first < a) or (first + n > a + len(frames)):
+            return None
+        return frames[first-a:first-a+n]
+
+    def put(self, clip, first, frames):
+        with self.lock:
+            self.entries.pop(id(clip), None)
+            self.entries[id(clip)] = (clip, first, frames)
+            total = sum([entry[2].nbytes for entry in self.entries.values()])
+            while (len(self.entries) > 1) and (total > self.maxBytes):
+                (_, (_, _, old)) = self.entries.popitem(last=False)
+                total -= old.nbytes
+
+class Player(object):
+    def __init__(self, fps=None, nchannels=None):
+        """Plays audio clips through a stream that stays open, at the project sample rate unless fps is given."""
+        self.fps = fps or projectFps()
+        self.nchannels = nchannels or projectChannels
+        self.ring = RingBuffer(int(bufferLength * self.fps), self.nchannels)
+        self.stream = None
+        self.clip = None
+        # where the clip started playing, the next sample to prefetch, and the sample after the last one, all in samples of clip time
+        (self.startFrame, self.nextFrame, self.endFrame) = (0, 0, 0)
+        # the ring buffer counter of the first sample of the clip
+        self.startCounter = 0
+        # whether the next samples prefetched are the first after a seek, and have to be spliced in
+        self.seeking = False
+        # whether to go back to loopStart at the end, instead of stopping
+        self.loop = False
+        self.loopStart = 0
+        # (counter, time) of the first sample of the last block the stream took, and when it will reach the speakers in stream time
+        self._lastBlock = None
+        # bumped whenever what is played changes, so the prefetcher can tell that what it just read is stale
+        self.generation = 0
+        self._cond = threading.Condition()
+        # readers of file clips can only do one thing at a time, so the player, the warmer and the jobs take turns. Holding it over a whole read keeps the sources of a mix from being moved about halfway through
+        self._readLock = readerLock
+        self.warm = WarmCache(warmMaxBytes)
+        # (clip, t) of what to read ahead next, see warmUp
+        self._wishes = []
+        self._warmer = None
+        self._prefetcher = threading.Thread(target=self._prefetch, daemon=True)
+        self._prefetcher.start()
+
+    def open(self):
+        """Opens the output stream. It plays silence until there is something to play."""
+        if self.stream is not None:
+            return
+        self.stream = sd.OutputStream(samplerate=self.fps, channels=self.nchannels, dtype="float32", blocksize=blockSize, latency="low", callback=self._callback)
+        self.stream.start()
+
+    def close(self):
+        self.stop()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def play(self, clip, t=0, end=None, loop=False):
+        """Plays the audio clip from t seconds on, instead of whatever was playing, up to end seconds if given. With loop, it plays from t to the end over and over until stopped."""
+        self.open()
+        with self._cond:
+            self.generation += 1
+            self.startCounter = self.ring.clear()
+            self.clip = clip
+            self.startFrame = int(round(t * self.fps))
+            self.nextFrame = self.startFrame
+            self.endFrame = int(clip.duration * self.fps) if end is None else min(int(clip.duration * self.fps), int(round(end * self.fps)))
+            self.seeking = False
+            (self.loop, self.loopStart) = (loop, self.startFrame)
+            self._cond.notify()
+
+    def seek(self, t, clip=None):
+        """Continues playing from t seconds, in clip if given, else in the clip that is playing. The new position takes over shortly after what the stream is playing right now, with a short crossfade."""
+        clip = clip or self.clip
+        if not(self.isPlaying()):
+            self.play(clip, t)
+            return
+        with self._cond:
+            # whatever was prefetched keeps playing until the first samples from t are there
+            self.generation += 1
+            self.clip = clip
+            self.nextFrame = int(round(t * self.fps))
+            self.endFrame = int(clip.duration * self.fps)
+            self.seeking = True
+            self.loop = False
+            self._cond.notify()
+
+    def stop(self):
+        """Stops playing, and returns the position in seconds where it stopped, or None if nothing was playing."""
+        with self._cond:
+            t = self.position() if self.isPlaying() else None
+            self.generation += 1
+            self.ring.clear()
+            self.clip = None
+        return t
+
+    def isPlaying(self):
+        # until everything up to the end of the clip went to the stream
+        return (self.clip is not None) and not((self.nextFrame >= self.endFrame) and (self.ring.available() == 0))
+
+    def position(self):
+        """Returns the position in seconds in the clip being played, of the sample that is coming out of the speakers right now."""
+        played = max(0, self.heardCounter() - self.startCounter)
+        if self.loop and (self.endFrame > self.loopStart):
+            return (self.loopStart + played % (self.endFrame - self.loopStart)) / self.fps
+        return (self.startFrame + played) / self.fps
+
+    def heardCounter(self):
+        # the ring buffer counter of the sample being heard. Samples reach the speakers a while after the stream took them, and the stream knows when
+        heard = self.ring.read
+        if self.stream is None:
+            return heard
+        block = self._lastBlock
+        if (block is not None) and (block[1] > 0):
+            heard = block[0] + (self.stream.time - block[1]) * self.fps
+        else:
+            # some systems don't tell the time a block is played. The latency is all we have then
+            heard -= self.stream.latency * self.fps
+        return int(round(min(heard, self.ring.read)))
+
+    def _callback(self, outdata, frames, time, status):
+        # runs on the audio thread. Nothing here may wait for anything, or change anything but the ring buffer's read counter and the time of the block
+        n = self.ring.readInto(outdata)
+        outdata[n:] = 0
+        self._lastBlock = (self.ring.read - n, time.outputBufferDacTime)
+
+    def _prefetch(self):
+        while True:
+            with self._cond:
+                # a seek replaces most of what is in the buffer, so it doesn't have to wait for space
+                while (self.clip is None) or (self.nextFrame >= self.endFrame) or (not(self.seeking) and (self.ring.space() < self._wanted())):
+                    if (self.clip is None) or (self.nextFrame >= self.endFrame):
+                        # nothing to do until play is called
+                        self._cond.wait()
+                    else:
+                        # the callback doesn't notify, so check back about once a prefetch
+                        self._cond.wait(prefetchLength / 2)
+                (generation, clip, first, seeking) = (self.generation, self.clip, self.nextFrame, self.seeking)
+                n = min(self._wanted(), self.endFrame - first)
+
+            try:
+                with self._readLock:
+                    frames = self._read(clip, first, n)
+            except Exception:
+                # the clip can't be read any further, e.g. because its file went away. Play what we have
+                frames = None
+
+            with self._cond:
+                if generation != self.generation:
+                    # stopped or moved on while we were reading
+                    continue
+                if frames is None:
+                    self.endFrame = first
+                    continue
+                if self.loop and not(isinstance(clip, Region)):
+                    frames = self._fadeLoopEdges(frames, first)
+                if seeking:
+                    self._splice(frames, first)
+                    self.seeking = False
+                else:
+                    self.ring.write(frames)
+                self.nextFrame += n
+                if self.loop and (self.nextFrame >= self.endFrame):
+                    self.nextFrame = self.loopStart
+
+    def _fadeLoopEdges(self, frames, first):
+        # a loop that is streamed rather than played from a Region fades in and out at its ends the same way, so that jumping back to the start doesn't click
+        k = min((self.endFrame - self.loopStart) // 2, int(seekFadeLength * self.fps))
+        i = first + np.arange(len(frames))
+        edge = np.minimum(i - self.loopStart, self.endFrame - 1 - i)
+        if (k <= 0) or (edge.min() >= k):
+            return frames
+        return frames * np.clip(edge / k, 0, 1).astype(np.float32)[:, None]
+
+    def _splice(self, frames, first):
+        # the sound from sample first on takes over a block after what the stream is playing now. The block in between gives the callback time to finish the one it may be in
+        ring = self.ring
+        cut = min(ring.written, max(ring.read, ring.cleared) + blockSize)
+        k = min(len(frames), int(seekFadeLength * self.fps))
+        ramp = (np.arange(k, dtype=np.float32) / max(1, k))[:, None]
+        frames = np.array(frames)
+        frames[:k] = ring.peek(cut, k) * (1 - ramp) + frames[:k] * ramp
+        # if this thread didn't get to run for a couple of blocks, e.g. because jobs hogged the interpreter, the callback may have read past cut by now. The new sound then starts where it got to, a few milliseconds late
+        cut = ring.rewind(cut)
+        ring.write(frames)
+        (self.startFrame, self.startCounter) = (first, cut)
+
+    def _wanted(self):
+        # samples to read next. Just a few right after starting or seeking, then bigger chunks
+        if self.seeking or (self.nextFrame == self.startFrame):
+            return int(firstPrefetchLength * self.fps)
+        return int(prefetchLength * self.fps)
+
+    def warmUp(self, wishes):
+        """Reads the first warmLength seconds from t on of each (clip, t) in wishes into memory, in the background, so that playing from there starts right away. Replaces whatever was wished for before and isn't read yet."""
+        with self._cond:
+            self._wishes = list(wishes)
+            if self._warmer is None:
+                self._warmer = threading.Thread(target=self._warmLoop, daemon=True)
+                self._warmer.start()
+            self._cond.notify_all()
+
+    def _warmLoop(self):
+        while True:
+            with self._cond:
+                # reading ahead mustn't hold up what is playing now
+                while (self._wishes == []) or self.isPlaying():
+                    self._cond.wait(None if self._wishes == [] else prefetchLength)
+                (clip, t) = self._wishes.pop(0)
+            first = int(round(t * self.fps))
+            n = min(int(warmLength * self.fps), int(clip.duration * self.fps) - first)
+            if (n <= 0) or (self.warm.get(clip, first, n) is not None):
+                continue
+            try:
+                frames = self._warmRead(clip, first, n)
+            except Exception:
+                # it'll be read when it's played, like anything else
+                frames = None
+            if frames is not None:
+                self.warm.put(clip, first, frames)
+
+    def _warmRead(self, clip, first, n):
+        # under the read lock, which the player shares with the jobs and overviews reading the same files, and in prefetch sized pieces, so that none of them waits long for its turn. Gives up if playback starts, as the wishes are probably stale by then
+        chunk = int(prefetchLength * self.fps)
+        pieces = []
+        for a in range(first, first + n, chunk):
+            if self.isPlaying():
+                return None
+            with self._readLock:
+                pieces.append(self._readClip(clip, a, min(chunk, first + n - a)))
+        return np.concatenate(pieces)
+
+    def _read(self, clip, first, n):
+        frames = self.warm.get(clip, first, n)
+        if frames is not None:
+            return frames
+        return self._readClip(clip, first, n)
+
+    def _readClip(self, clip, first, n):
+        frames = np.asarray(clip.get_frame((first + np.arange(n)) / self.fps), dtype=np.float32).reshape((n, -1))
+        if frames.shape[1] == self.nchannels:
+            return frames
+        if frames.shape[1] == 1:
+            return np.repeat(frames, self.nchannels, axis=1)
+        if frames.shape[1] > self.nchannels:
+            return frames[:, :self.nchannels]
+        return np.pad(frames, ((0, 0), (0, self.nchannels - frames.shape[1])))
@@ -0,0 +1,123 @@
+import os, glob, time, threading, multiprocessing
+import proglog
+
+# Progress of long renders
+# Renders run in a background thread, and partly in worker processes forked from it. They all report to the same Progress, which lives in shared memory, and check it to see whether the user has cancelled.
+# Work is measured in seconds of rendered material, so that a track with one long clip isn't half done after its first short one.
+
+class RenderCancelled(Exception):
+    pass
+
+class Progress(object):
+    def __init__(self, name):
+        """Creates the progress of a render called name."""
+        self.name = name
+        # forked workers get the same memory, not copies
+        self._done = multiprocessing.Value("d", 0.0)
+        self._total = multiprocessing.Value("d", 0.0)
+        self._cancelled = multiprocessing.Value("i", 0)
+        self.started = time.time()
+        self.lastReport = self.started
+
+    def expect(self, seconds):
+        with self._total.get_lock():
+            self._total.value += seconds
+
+    def advance(self, seconds):
+        with self._done.get_lock():
+            self._done.value += seconds
+
+    def fraction(self):
+        if self._total.value <= 0:
+            return 0.0
+        return min(1.0, self._done.value / self._total.value)
+
+    def eta(self):
+        """Returns the estimated number of seconds until the render is done, or None if it is too early to tell."""
+        f = self.fraction()
+        if f < 0.02:
+            return None
+        return (time.time() - self.started) * (1 - f) / f
+
+    def cancel(self):
+        self._cancelled.value = 1
+
+    def isCancelled(self):
+        return self._cancelled.value == 1
+
+    def check(self):
+        """Raises RenderCancelled if the render was cancelled. Long running loops should call this regularly."""
+        if self.isCancelled():
+            raise RenderCancelled()
+
+    def describe(self):
+        w = str(int(self.fraction() * 100)) + " percent"
+        eta = self.eta()
+        if eta is None:
+            return w + "."
+        if eta < 10:
+            return w + ", almost done."
+        if eta < 90:
+            return w + ", about " + str(int(round(eta / 10) * 10)) + " seconds left."
+        return w + ", about " + str(int(round(eta / 60))) + " minutes left."
+
+
+_local = threading.local()
+
+def currentProgress():
+    """Returns the Progress of the render running in this thread, or None."""
+    return getattr(_local, "progress", None)
+
+def setCurrentProgress(progress):
+    _local.progress = progress
+
+def expectProgress(seconds):
+    p = currentProgress()
+    if p is not None:
+        p.expect(seconds)
+
+def reportProgress(seconds):
+    p = currentProgress()
+    if p is not None:
+        p.advance(seconds)
+
+def checkCancelled():
+    p = currentProgress()
+    if p is not None:
+        p.check()
+
+
+class RenderLogger(proglog.ProgressBarLogger):
+    def __init__(self, progress, weights):
+        """Passes moviepy's progress bars on to progress. weights maps the names of bars to the number of seconds of material they stand for."""
+        proglog.ProgressBarLogger.__init__(self)
+        self.progress = progress
+        self.weights = weights
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        # moviepy doesn't know about cancelling. This is called for every frame though, so we just raise right through it
+        self.progress.check()
+        if (attr != "index") or (bar not in self.weights):
+            return
+        total = self.bars[bar]["total"]
+        if not(total):
+            return
+        self.progress.advance(self.weights[bar] * (value - max(0, old_value or 0)) / total)
+
+def renderLogger(duration, video=True, audio=True):
+    """Returns a logger for moviepy's write functions that reports to the current progress, or "bar" if there is none. duration is the length of the clip being written."""
+    p = currentProgress()
+    if p is None:
+        return "bar"
+    if video and audio:
+        # sound is written first, and is much quicker
+        return RenderLogger(p, {"chunk" : 0.1 * duration, "frame_index" : 0.9 * duration})
+    if video:
+        return RenderLogger(p, {"frame_index" : duration})
+    return RenderLogger(p, {"chunk" : duration})
+
+def removeMoviepyTempFiles(file):
+    # moviepy puts the sound of a video it writes into the working directory, and only removes it when it's done
+    (name, _) = os.path.splitext(os.path.basename(file))
+    for tmp in glob.glob(name + "TEMP_MPY_*"):
+        os.remove(tmp)
@@ -0,0 +1,153 @@
+import os, gc, shutil, threading, multiprocessing
+from tempfile import mkdtemp
+from tanto.clip import *
+
+# Rendering clips in worker processes.
+# Open moviepy clips can't be pickled, since they hold pipes to running ffmpeg processes. Instead, we fork, and the workers pick their clip out of _jobs by index.
+# After the fork, a worker shares the parent's ffmpeg readers. It starts fresh ffmpeg processes for the readers of its own clip before it touches any frames.
+# The parent has other threads running, the player's among them. A worker never plays anything or talks to the audio device, and forks wait for pcm.readerLock, so the one lock a worker needs is never inherited in the hands of a thread that doesn't exist in it.
+# spawn or forkserver would avoid inheriting threads altogether, but they pickle the clips, which moviepy clips, made of lambdas and pipes, don't survive.
+
+_jobs = []
+# how many of them render at once
+_poolSize = 1
+_ownReaders = set()
+# renders may be started from several job threads. Only one pool at a time gets to use _jobs, and to switch the garbage collector off
+_poolLock = threading.Lock()
+
+def defaultWorkers():
+    return os.cpu_count() or 1
+
+def canFork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+def reopenReaders(clip):
+    for reader in findReaders(clip):
+        if id(reader) in _ownReaders:
+            continue
+        # don't close the inherited process, that would kill it for the parent as well. Just forget about it.
+        reader.proc = None
+        reader.initialize()
+        _ownReaders.add(id(reader))
+
+def _renderJob(i):
+    (clip, file, kwargs) = _jobs[i]
+    # jobs that were still queued when the render got cancelled
+    checkCancelled()
+    reopenReaders(clip)
+    writeClip(clip, file, workers=_poolSize, **kwargs)
+    return file
+
+def renderParallel(jobs, workers=None):
+    """Renders a list of (clip, file, kwargs) triples, as returned by prepareSaveClip, with writeClip. Uses up to workers processes at once. Returns the list of written files."""
+    global _jobs, _poolSize
+    if workers is None:
+        workers = defaultWorkers()
+
+    if len(jobs) == 1:
+        # one big clip, e.g. a merged track. Slicing it in time is the only way to keep more than one encoder busy
+        (clip, file, kwargs) = jobs[0]
+        writeClipSliced(clip, file, workers=workers, **kwargs)
+        return [file]
+
+    if (workers <= 1) or (len(jobs) <= 1) or not(canFork()):
+        for (clip, file, kwargs) in jobs:
+            writeClip(clip, file, **kwargs)
+        return [file for (clip, file, kwargs) in jobs]
+
+    with _poolLock:
+        _jobs = jobs
+        _poolSize = min(workers, len(jobs))
+        # a reader collected while workers are alive would hang in close(): the workers hold copies of its pipe, so its ffmpeg never exits. Clean up before forking, and not at all until the workers are gone
+        gc.collect()
+        gc.disable()
+        try:
+            with multiprocessing.get_context("fork").Pool(_poolSize) as pool:
+                try:
+                    files = pool.map(_renderJob, range(len(jobs)), chunksize=1)
+                except RenderCancelled:
+                    # the other workers notice as well. Let them clean up their temp files instead of killing them mid write
+                    pool.close()
+                    pool.join()
+                    raise
+        finally:
+            (_jobs, _poolSize) = ([], 1)
+            gc.enable()
+    return files
+
+
+def sliceBoundaries(duration, fps, n, keyint):
+    """Returns a list of (start, end) times that divide a clip of given duration into at most n slices. Slices start on multiples of keyint frames, so that they begin exactly where an encoder with a fixed GOP of keyint frames would put a keyframe anyway."""
+    nframes = int(duration * fps)
+    cuts = [0]
+    for k in range(1, n):
+        frame = int(round((k * nframes / n) / keyint)) * keyint
+        if (frame > cuts[-1]) and (frame < nframes):
+            cuts.append(frame)
+
+    acc = []
+    for i in range(0, len(cuts)):
+        start = cuts[i] / fps
+        if i == len(cuts) - 1:
+            end = duration
+        else:
+            # the extra half frame keeps moviepy from dropping the last frame of a slice to float rounding
+            end = min(duration, (cuts[i+1] + 0.5) / fps)
+        acc.append((start, end))
+    return acc
+
+def writeClipSliced(clip, file, workers=None, keyint=None, **kwargs):
+    """Like writeClip, but renders a video clip in time slices, each in its own worker process. The video slices are then joined with the audio, which is rendered in one piece, without reencoding."""
+    if workers is None:
+        workers = defaultWorkers()
+
+    if (workers <= 1) or not(canFork()) or not(isVideoClip(clip)) or (clip.duration is None):
+        writeClip(clip, file, **kwargs)
+        return
+
+    fps = renderFps(clip, kwargs.get("profile", None))
+    if keyint is None:
+        keyint = int(round(2 * fps))
+    slices = sliceBoundaries(clip.duration, fps, workers, keyint)
+    if len(slices) <= 1:
+        writeClip(clip, file, **kwargs)
+        return
+
+    ext = getExtension(file)
+    tmpdir = mkdtemp()
+    # fixed GOP and no scene cut detection, so keyframes fall on the same frames no matter where a slice starts
+    videoKwargs = {k : v for (k, v) in kwargs.items() if not(k.startswith("audio"))}
+    videoKwargs["audio"] = False
+    videoKwargs["ffmpeg_params"] = videoKwargs.get("ffmpeg_params", []) + ["-g", str(keyint), "-keyint_min", str(keyint), "-sc_threshold", "0"]
+    jobs = []
+    for i in range(0, len(slices)):
+        (start, end) = slices[i]
+        jobs.append((clip.subclip(start, end).with_fps(fps), os.path.join(tmpdir, str(i) + "." + ext), videoKwargs))
+
+    audiofile = None
+    if clip.audio is not None:
+        audiofile = os.path.join(tmpdir, "audio." + ("ogg" if ext in ["ogv", "webm"] else "mp3"))
+        audioKwargs = {}
+        if "audio_bitrate" in kwargs:
+            audioKwargs["bitrate"] = kwargs["audio_bitrate"]
+        jobs.append((clip.audio, audiofile, audioKwargs))
+        # on top of the video, which is what callers expect
+        expectProgress(clip.audio.duration)
+
+    try:
+        renderParallel(jobs, workers=workers)
+        listfile = os.path.join(tmpdir, "slices.txt")
+        with open(listfile, "w") as f:
+            for i in range(0, len(slices)):
+                f.write("file '" + os.path.join(tmpdir, str(i) + "." + ext) + "'\n")
+
+        tmpfile = os.path.join(tmpdir, "out." + ext)
+        if audiofile is None:
+            r = ffmpeg_run(["-map", "0:v", "-c", "copy"], input=listfile, output=tmpfile, inputOptions=["-f", "concat", "-safe", "0"])
+        else:
+            r = ffmpeg_run(["-i", audiofile, "-map", "0:v", "-map", "1:a", "-c", "copy"], input=listfile, output=tmpfile, inputOptions=["-f", "concat", "-safe", "0"])
+        if r.returncode != 0:
+            raise RuntimeError("writeClipSliced: ffmpeg failed to join slices for " + file)
+        shutil.move(tmpfile, file)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
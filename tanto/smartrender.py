@@ -0,0 +1,199 @@
+import os, shutil, subprocess
+from bisect import bisect_left, bisect_right
+from tempfile import mkdtemp
+from tanto.clip import *
+from tanto.frameindex import *
+
+# Smart rendering
+# Cutting a file with stream copy is fast, but the cut can only start on a keyframe. Reencoding is frame accurate, but has to touch every single frame.
+# Smart rendering does both: the frames between an edit point and the next keyframe are reencoded, everything from there up to the last keyframe before the next edit point is copied as it is.
+# Every keyframe of a piece carries its own codec headers in-band. That way, reencoded and copied pieces can be joined even though they were encoded with different settings.
+
+# containers we write smart renders to
+smartRenderExtensions = [".mkv", ".mp4", ".mov"]
+
+def _videoSignature(file):
+    return [desc for (kind, desc) in ffmpeg_streams(file) if kind == "Video"]
+
+def _audioSignature(file):
+    return [desc for (kind, desc) in ffmpeg_streams(file) if kind == "Audio"]
+
+# encoders for the audio codecs ffmpeg doesn't have an encoder of the same name for
+_audioEncoders = {"mp3" : "libmp3lame", "opus" : "libopus", "vorbis" : "libvorbis"}
+
+def canSmartRender(segments):
+    """Returns True if the edit list segments can be smart rendered. This requires all segments to play untouched h264 video files with identical stream parameters, without gain or fades."""
+    if segments == []:
+        return False
+
+    for seg in segments:
+        if (seg.getFile() is None) or not(isVideoClip(seg.source)):
+            return False
+        if (seg.gain != 1) or (seg.fadeIn > 0) or (seg.fadeOut > 0):
+            return False
+
+    # either all segments have sound, or none
+    if len(set([seg.source.audio is None for seg in segments])) != 1:
+        return False
+
+    try:
+        signatures = [_videoSignature(seg.getFile()) for seg in segments]
+    except OSError:
+        return False
+    if (len(signatures[0]) == 0) or not(signatures[0][0].startswith("h264")):
+        return False
+    return all([sig == signatures[0] for sig in signatures])
+
+def _smartPieces(seg, frames):
+    # returns a list of (mode, first, last) frame ranges, with last exclusive, that play seg when joined
+    (times, keyframes) = (frames.times, frames.keyframes)
+    # by timestamps rather than frame rate, so that variable frame rates and files that don't start at 0 are cut where moviepy would
+    a = frames.frameAt(seg.tin)
+    b = len(times) if seg.tout >= seg.source.duration - 0.0005 else frames.frameAt(seg.tout)
+    if b <= a:
+        return []
+
+    # first keyframe at or after a, and last one at or before b
+    i = bisect_left(keyframes, a)
+    j = bisect_right(keyframes, b) - 1
+    if (i >= len(keyframes)) or (j < 0) or (keyframes[i] >= keyframes[j]):
+        return [("encode", a, b)]
+    (k1, k2) = (keyframes[i], keyframes[j])
+
+    acc = []
+    if a < k1:
+        acc.append(("encode", a, k1))
+    acc.append(("copy", k1, k2))
+    if k2 < b:
+        acc.append(("encode", k2, b))
+    return acc
+
+def _framesDuration(frames, fps, first, last):
+    times = frames.times
+    if last < len(times):
+        return times[last] - times[first]
+    return times[last - 1] - times[first] + 1 / fps
+
+def _copyFrames(file, frames, first, last, output, bsf=[]):
+    # stream copies the frames from first up to last, first being a keyframe
+    order = frames.order
+    end = order[last] if last < len(order) else len(order)
+    positions = order[first:last]
+    if (min(positions) != order[first]) or (max(positions) != end - 1):
+        # open GOPs: the frames we want are mixed up with ones we don't in the file
+        return False
+
+    # seeking on input jumps right to the piece instead of reading through the file up to it. If ffmpeg starts on keyframe first, the piece is the next last - first packets. A second output lists the checksums of the packets it took, so we know whether it did
+    count = ["-frames:v", str(last - first)]
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-ss", str(frames.keyframeSeekTime(first)), "-i", file]
+    cmd += ["-map", "0:v:0", "-an", "-c:v", "copy"] + (["-bsf:v", ",".join(bsf)] if bsf else []) + count + [output]
+    cmd += ["-map", "0:v:0", "-an", "-c:v", "copy"] + count + ["-f", "framecrc", "-"]
+    r = subprocess.run(cmd, capture_output=True, text=True)
+    if (r.returncode == 0) and ([crc for (pts, key, crc) in parseFramecrc(r.stdout)[1]] == frames.crcs[order[first]:end]):
+        return True
+
+    # the seek landed somewhere else. Reading from the start and picking packets by their position in the stream always works, it just takes longer. That is only demuxing, no decoding.
+    keep = "between(n\\,%d\\,%d)" % (order[first], end - 1)
+    r = ffmpeg_run(["-map", "0:v:0", "-an", "-c:v", "copy", "-bsf:v", ",".join(["noise=drop=not(" + keep + ")"] + bsf), "-frames:v", str(last - first)], input=file, output=output)
+    return r.returncode == 0
+
+def _renderPiece(file, frames, mode, first, last, output):
+    if mode == "copy":
+        # every keyframe gets its codec headers in-band
+        return _copyFrames(file, frames, first, last, output, bsf=["h264_mp4toannexb", "dump_extra"])
+
+    # reencoding needs the frames from the keyframe before first. We copy out the GOPs in question, then decode just those, so that we can count frames from a known start
+    (times, keyframes) = (frames.times, frames.keyframes)
+    k0 = keyframes[max(0, bisect_right(keyframes, first) - 1)]
+    i = bisect_left(keyframes, last)
+    kend = keyframes[i] if i < len(keyframes) else len(times)
+    gops = output + ".gops.mkv"
+    if not(_copyFrames(file, frames, k0, kend, gops)):
+        return False
+    select = "select=between(n\\,%d\\,%d)" % (first - k0, last - k0 - 1)
+    args = ["-map", "0:v:0", "-vf", select, "-fps_mode", "passthrough", "-frames:v", str(last - first), "-c:v", "libx264", "-preset", renderProfiles[getRenderProfile()]["preset"], "-crf", "17", "-bsf:v", "dump_extra"]
+    r = ffmpeg_run(args, input=gops, output=output)
+    os.remove(gops)
+    return r.returncode == 0
+
+def _encodeAudioArgs(segments, bitrate=None):
+    # ffmpeg arguments that encode sound like that of the first segment's file, at bitrate if given, else at the file's
+    codec = _audioSignature(segments[0].getFile())[0].split(" ")[0]
+    args = ["-c:a", _audioEncoders.get(codec, codec)]
+    bitrate = bitrate or getAudioBitrate(segments[0].source, default=None)
+    if (bitrate is not None) and not(codec.startswith("pcm_") or codec in ["flac", "alac"]):
+        args += ["-b:a", str(bitrate)]
+    return args
+
+def smartRenderEditList(segments, file, audio_bitrate=None):
+    """Renders the clip described by edit list segments to file, reencoding only the frames around edit points. Check with canSmartRender first. Sound is rendered exactly, and encoded with the codec of the first source file, at audio_bitrate if given. Returns False if the clip couldn't be smart rendered, in which case it has to be rendered normally."""
+    (_, ext) = os.path.splitext(file)
+    if ext.lower() not in smartRenderExtensions:
+        return False
+
+    tmpdir = mkdtemp()
+    expected = sum([seg.tout - seg.tin for seg in segments])
+    expectProgress(expected)
+    try:
+        pieces = []
+        for seg in segments:
+            frames = ffmpeg_frames(seg.getFile())
+            if frames is None:
+                return False
+            for (mode, first, last) in _smartPieces(seg, frames):
+                checkCancelled()
+                piece = os.path.join(tmpdir, str(len(pieces)) + ".mkv")
+                if not(_renderPiece(seg.getFile(), frames, mode, first, last, piece)):
+                    return False
+                pieces.append((piece, _framesDuration(frames, seg.source.fps, first, last)))
+                reportProgress(pieces[-1][1])
+                expected -= pieces[-1][1]
+        if pieces == []:
+            return False
+
+        listfile = os.path.join(tmpdir, "pieces.txt")
+        with open(listfile, "w") as f:
+            for (piece, duration) in pieces:
+                # pieces keep the timestamps of their source, so the duration ffmpeg would guess from them is off by wherever the piece started
+                f.write("file '" + piece + "'\nduration %.6f\n" % duration)
+
+        args = ["-map", "0:v", "-c:v", "copy"]
+        if segments[0].source.audio is not None:
+            # the sound is rendered exactly and encoded like the source. Copying it would cut on packets, and lose the encoder's priming at every cut, which moves it early. Next to the video, this is cheap
+            audiofile = os.path.join(tmpdir, "audio.wav")
+            audio = makeEditListAudioClip([Segment(seg.source.audio, seg.tin, seg.tout) for seg in segments])
+            audio.write_audiofile(audiofile, fps=audio.fps, logger=None)
+            args = ["-i", audiofile] + args + ["-map", "1:a"] + _encodeAudioArgs(segments, audio_bitrate)
+
+        tmpfile = os.path.join(tmpdir, "out" + ext)
+        r = ffmpeg_run(args, input=listfile, output=tmpfile, inputOptions=["-f", "concat", "-safe", "0"])
+        if r.returncode != 0:
+            return False
+        shutil.move(tmpfile, file)
+        return True
+    finally:
+        # count what we didn't get to as done. If we failed, whatever renders the clip instead will expect it anew
+        reportProgress(max(0, expected))
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def smartEditListClip(segments, audio_bitrate=None):
+    """Like makeEditListClip, but smart renders segments to a temporary file right away. Returns the file clip, or None if segments can't be smart rendered."""
+    if not(canSmartRender(segments)):
+        return None
+
+    (_, ext) = os.path.splitext(segments[0].getFile())
+    if ext.lower() not in smartRenderExtensions:
+        ext = ".mkv"
+    file = makeTempClipFile(ext)
+    if not(smartRenderEditList(segments, file, audio_bitrate=audio_bitrate)):
+        return None
+
+    clip = openVideoFile(file)
+    setFilepath(clip, file)
+    return clip
+
+def smartSubclip(clip, a, b=None, audio_bitrate=None):
+    """Frame accurate version of ffmpeg_subclip. Returns None if clip can't be smart rendered."""
+    if b is None:
+        b = clip.duration
+    return smartEditListClip(editListSlice(getEditList(clip), a, b), audio_bitrate=audio_bitrate)
@@ -0,0 +1,57 @@
+import numpy as np
+from moviepy.audio.AudioClip import AudioClip
+from tanto.pcm import projectFps, projectChannels
+
+# Synthetic sound
+# Silence, tones and noise are computed from the time they're asked for, so they cost neither disk space nor an ffmpeg process, however long they are. The mixer knows silence when it sees it, and doesn't even compute that.
+
+class SyntheticAudioClip(AudioClip):
+    def __init__(self, duration, fps=None, nchannels=projectChannels):
+        """Base class of sounds that are computed on the fly, at the project sample rate unless fps is given. Subclasses implement samples."""
+        self.synthChannels = nchannels
+        AudioClip.__init__(self, make_frame=self.synthesize, duration=duration, fps=fps or projectFps())
+
+    def samples(self, t):
+        """Returns one sample per time in the array t, for all channels alike."""
+        raise NotImplementedError()
+
+    def synthesize(self, t):
+        tt = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.repeat(self.samples(tt)[:, None], self.synthChannels, axis=1)
+        if np.ndim(t) == 0:
+            return out[0]
+        return out
+
+class SilenceClip(SyntheticAudioClip):
+    def samples(self, t):
+        return np.zeros(len(t))
+
+class ToneClip(SyntheticAudioClip):
+    def __init__(self, duration, frequency=1000, gain=0.5, fps=None, nchannels=projectChannels):
+        """A sine wave of frequency Hz, with amplitude gain. The default is the classic 1 kHz beep used for bleeping words out."""
+        self.frequency = frequency
+        self.gain = gain
+        SyntheticAudioClip.__init__(self, duration, fps=fps, nchannels=nchannels)
+
+    def samples(self, t):
+        return self.gain * np.sin(2 * np.pi * self.frequency * t)
+
+class NoiseClip(SyntheticAudioClip):
+    def __init__(self, duration, gain=0.1, seed=0, fps=None, nchannels=projectChannels):
+        """White noise with amplitude gain. Samples only depend on their time and seed, so reading the same time twice gives the same sound, like a file would."""
+        self.gain = gain
+        self.seed = seed
+        SyntheticAudioClip.__init__(self, duration, fps=fps, nchannels=nchannels)
+
+    def samples(self, t):
+        # a hash of the sample number (splitmix64), rather than a random generator that would have to be wound forward to t
+        with np.errstate(over="ignore"):
+            x = np.round(t * self.fps).astype(np.int64).astype(np.uint64) + np.uint64(self.seed) * np.uint64(0x9E3779B97F4A7C15)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            x = x ^ (x >> np.uint64(31))
+        return self.gain * ((x >> np.uint64(11)).astype(float) / 2.0**52 - 1)
+
+def isSilent(clip):
+    # time shifts, subclips and volume changes of silence are still silence, and moviepy keeps the class for all of them
+    return isinstance(clip, SilenceClip)
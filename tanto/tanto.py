@@ -25,10 +25,14 @@ from tanto.speak import Speaker
 from tanto.track import Track
 from tanto.tanto_utility import *
 from tanto.tanto_audiorecorder import AudioRecorder
+from tanto.playback import Player
 from tanto.tanto_gui import *
 from tanto import _interactive
 from tanto import _keybindings
 from tanto.clip import *
+from tanto.render import defaultWorkers
+from tanto.cache import RenderCache
+from tanto.jobs import *
 from tanto.args import makeArgParser, makeHelpText
 import tanto
 
@@ -39,9 +43,8 @@ class ViewState(object):
         self.args = args
         self.ui = TantoGui(res=res, manager=ui)
         self.lastMsg = ""
-        self.clock = pygame.time.Clock()
         self.textinput = textinput
-        self.audiorecorder = AudioRecorder()
+        self.audiorecorder = AudioRecorder(samplerate=projectFps(), channels=projectChannels)
         self.projectdir = projectdir
         self.running = True
         self.tts = tts
@@ -53,11 +56,37 @@ class ViewState(object):
         self.currentTrack = None
         self.clipboard = None
         self.saveMark = None
-        self.video_flag = threading.Event()
-        self.audio_flag = threading.Event()
+        # one stream for all playback, open for as long as the program runs
+        self.player = Player()
+        try:
+            self.player.open()
+        except Exception:
+            logging.error("Couldn't open sound output. " + traceback.format_exc())
+        # (track, mix, starts) of the last track played as a whole, see playTrack
+        self.playingTrack = None
+        # seconds peekMark plays before and after the mark, and the part of a clip that was played last from memory
+        self.peekLength = 1.0
+        self.playedRegion = None
         self.isRecordingAudio = False
         self.audioData = None
 
+        if args is not None:
+            self.renderWorkers = args.jobs
+        else:
+            self.renderWorkers = defaultWorkers()
+        self.renderCache = None
+        self.jobs = JobScheduler(workers=args.job_threads if args is not None else 4)
+        self.progressReportInterval = 15 # in seconds
+        if projectdir:
+            cacheSize = args.cache_size if args is not None else 10240
+            self.renderCache = RenderCache(os.path.join(projectdir, ".tanto-cache"), maxBytes=cacheSize*1024**2)
+            # keyframe indices of source files. They are small, and not subject to the cache size
+            setFrameIndexDir(os.path.join(projectdir, ".tanto-cache", "index"))
+            pcmCacheSize = args.pcm_cache_size if args is not None else 4096
+            setPCMCacheDir(os.path.join(projectdir, ".tanto-cache", "pcm"), maxBytes=pcmCacheSize*1024**2)
+            setOverviewDir(os.path.join(projectdir, ".tanto-cache", "overview"))
+            setLoudnessDir(os.path.join(projectdir, ".tanto-cache", "loudness"))
+
         self.quietFactor = 0.2
         self.smallTimeStep = 1 # in seconds
         self.largeTimeStep = 60 # in seconds
@@ -225,12 +254,9 @@ class ViewState(object):
         begin = min(mark, pos)
         end = max(mark,pos)
 
-        preclip = clip.subclip(0, begin)
-        sclip = clip.subclip(begin, end)
-        if end >= clip.duration:
-            afterclip = clip.subclip(0,0)
-        else:
-            afterclip = clip.subclip(end)
+        preclip = editSubclip(clip, 0, begin)
+        sclip = editSubclip(clip, begin, end)
+        afterclip = editSubclip(clip, end)
         return (preclip, sclip, afterclip)
 
 
@@ -373,6 +399,43 @@ class ViewState(object):
 
         track.data[track.index] = clip
 
+    def startJob(self, name, work, cont=None, priority=PRIORITY_NORMAL):
+        """Runs work in the background, and tells the user how far along it is every now and then. Once work is done, cont is called with its return value on the main thread, and the message it returns is spoken. Returns the Job."""
+        return self.jobs.submit(name, work, cont=cont, priority=priority)
+
+    def updateJobs(self):
+        # called from the main loop
+        msgs = []
+        now = time.time()
+        for job in self.jobs.running():
+            progress = job.progress
+            if progress.isCancelled() or (progress.fraction() == 0) or (now - progress.lastReport < self.progressReportInterval):
+                continue
+            progress.lastReport = now
+            msgs.append(job.describe())
+
+        for job in self.jobs.collect():
+            if job.state == "cancelled":
+                msgs.append("Cancelled " + job.name + ".")
+            elif job.state == "failed":
+                logging.error(job.traceback)
+                msgs.append(job.name[:1].upper() + job.name[1:] + " failed.")
+            elif job.cont is not None:
+                try:
+                    msgs.append(job.cont(job.result))
+                except Exception as e:
+                    logging.error(traceback.format_exc())
+                    msgs.append("exception")
+            else:
+                msgs.append("Done " + job.name + ".")
+
+        msgs = [msg for msg in msgs if msg]
+        if msgs == []:
+            return
+        self.lastMsg = " ".join(msgs)
+        self.updateUI()
+        self.tts.speak(self.lastMsg)
+
     def updateUI(self):
         override = None
         if self.isTextMode():
@@ -422,11 +485,10 @@ def main():
             print(makeHelpText())
         return
         
-    buffer = 2 * 2048
-    freq=48000
-    pygame.mixer.pre_init(frequency=freq, buffer=buffer)
+    setProjectFps(args.sample_rate)
     pygame.init()
-    pygame.mixer.init(freq, -16, 2, buffer)    
+    # sound goes through our own output stream, see playback.py. pygame shouldn't hold on to the device
+    pygame.mixer.quit()
     screen = pygame.display.set_mode((args.xres,args.yres))
     clock = pygame.time.Clock()
     textinput = pygame_textinput.TextInputVisualizer()
@@ -500,6 +562,7 @@ def main():
 
             st.ui.manager.process_events(event)
 
+        st.updateJobs()
         st.ui.manager.update(time_delta)
         screen.fill(pygame.color.THECOLORS["black"])
         st.ui.manager.draw_ui(screen)            
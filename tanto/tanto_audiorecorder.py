@@ -20,6 +20,7 @@ class AudioRecorder(object):
         self.flag = threading.Event()
         self.data = Queue()
         self.file = mktemp(suffix=".wav")        
+        self.thread = None
 
 
 
@@ -55,8 +56,8 @@ class AudioRecorder(object):
         
         self._init()
         self.flag.set()
-        t = threading.Thread(target=self._worker)
-        t.start()
+        self.thread = threading.Thread(target=self._worker)
+        self.thread.start()
         return True
     
 
@@ -66,6 +67,11 @@ class AudioRecorder(object):
         
         self.flag.clear()
         return self.file
+
+    def join(self):
+        # waits until the file returned by stop is complete
+        if self.thread is not None:
+            self.thread.join()
         
         
         
@@ -5,9 +5,10 @@ from moviepy.editor import *
 from datetime import timedelta
 import random, json
 import subprocess
-import wave
 import screeninfo
 import tanto
+from tanto.synth import *
+from tanto.pcm import openAudioFile, usePCMCache
 
 def toTimecode(seconds):
     return str(timedelta(seconds=seconds))
@@ -213,24 +214,14 @@ def makeVoiceClip(w):
     (r, tmpwavfile) = maybeResult
     if not(r):
         return None
-    clip = AudioFileClip(tmpwavfile)
+    clip = openAudioFile(tmpwavfile)
+    # played over and over while it's being placed, like any imported sound
+    usePCMCache(clip)
     return clip
     
 def makeSilenceClip(duration):
-    # Open a (new if necessary) wave file for binary writing
-    (fh, tmpfilename) = mkstemp()
-    outf = wave.open(tmpfilename, "wb")
-    framerate = 48000
-    bytesperframe = 2 # 2 -> 16 bit
-    outf.setframerate(48000)
-    outf.setnchannels(1)
-    outf.setnframes(int(duration * framerate))
-    outf.setsampwidth(bytesperframe)
-    outf.writeframes(bytes(0 for i in range(int(duration * framerate) * bytesperframe)))
-
-
-    clip = AudioFileClip(tmpfilename)
-    return clip
+    # computed on the fly, so any length is instant
+    return SilenceClip(duration)
 
 
 def isFloat(w):
@@ -3,6 +3,9 @@ import os, glob
 from moviepy.editor import *
 from tanto.tanto_utility import *
 from tanto.clip import *
+from tanto.render import *
+from tanto.cache import *
+from tanto.smartrender import *
 import copy
 
 class Tag(object):
@@ -259,16 +262,69 @@ class Track(object):
             f.write(str(self.__dict__[key]))
             f.close()
             
-    def save(self, projectdir):
-        self.temporary = False        
-        self.storeVars(projectdir)        
+    def save(self, projectdir, workers=1, cache=None):
+        self.markSaved(projectdir)
+        self.render(projectdir, list(self.data), workers=workers, cache=cache)
+
+    def markSaved(self, projectdir):
+        self.temporary = False
+        self.storeVars(projectdir)
+
+    def render(self, projectdir, clips, workers=1, cache=None):
+        """Writes clips, the clips of this track at the time of saving, into the track's directory. Doesn't change the track, so that it can run in a job."""
         if self.file:
             return
 
         dir = self.assertDir(projectdir)
-        for i in range(len(self.data)):
-            clip = self.data[i]
-            saveClip(clip, dir + str(i), video_bitrate=self.video_bitrate, audio_bitrate=self.audio_bitrate)
+        (jobs, keys, smart) = ([], [], [])
+        for i in range(len(clips)):
+            checkCancelled()
+            clip = clips[i]
+            renderKey = getRenderKey(clip) if cache is not None else None
+            aliasKey = renderKey if hasRenderKey(clip) else None
+            job = prepareSaveClip(clip, dir + str(i), video_bitrate=self.video_bitrate, audio_bitrate=self.audio_bitrate)
+            if job is None:
+                continue
+            (_, file, kwargs) = job
+            key = saveKey(renderKey, file, kwargs)
+            if (cache is not None) and cache.fetch(key, file):
+                # rendered this exact clip before
+                continue
+            if canSmartRender(getEditList(clip)):
+                smart.append((job, (key, aliasKey)))
+                continue
+            jobs.append(job)
+            keys.append((key, aliasKey))
+            expectProgress(clip.duration)
+
+        if smart:
+            # cut from files, and only the frames around the cuts have to be reencoded. That is mostly waiting for ffmpeg, so a thread per worker does
+            progress = currentProgress()
+            def smartRender(job):
+                setCurrentProgress(progress)
+                (clip, file, kwargs) = job
+                return smartRenderEditList(getEditList(clip), file, audio_bitrate=self.audio_bitrate)
+            with ThreadPool(max(1, min(len(smart), workers))) as pool:
+                results = pool.map(smartRender, [job for (job, _) in smart])
+            for ((job, (key, aliasKey)), ok) in zip(smart, results):
+                if not(ok):
+                    # rendered like any other clip after all
+                    jobs.append(job)
+                    keys.append((key, aliasKey))
+                    expectProgress(job[0].duration)
+                elif cache is not None:
+                    cache.store(key, job[1])
+                    cache.store(aliasKey, job[1])
+            checkCancelled()
+
+        # clips are independent of each other, so we can keep one encoder per core busy
+        renderParallel(jobs, workers=workers)
+        if cache is None:
+            return
+        for ((_, file, _), (key, aliasKey)) in zip(jobs, keys):
+            cache.store(key, file)
+            # merges look their result up by the key they were given, not by what they were saved as
+            cache.store(aliasKey, file)
                 
     def assertDir(self, projectdir):
         if self.file:
@@ -292,12 +348,12 @@ class Track(object):
         if isVideoFile(file):
             if self.isAudioOnly():
                 return
-            clip = VideoFileClip(file)
+            clip = openVideoFile(file)
             # moviepy has trouble detecting bitrate in mkv and webm format, which we default to
             self.video_bitrate = getVideoBitrate(clip, file, default=self.video_bitrate)
             self.audio_bitrate = getAudioBitrate(clip.audio, file, default=self.audio_bitrate)            
         elif isAudioFile(file):
-            clip = AudioFileClip(file)
+            clip = openAudioFile(file)
             self.audio_bitrate = getAudioBitrate(clip, file, default=self.audio_bitrate)
         elif isImageFile(file):
             self.image = True
@@ -384,66 +440,79 @@ class Track(object):
     def getDuration(self):
         return sum([clip.duration for clip in self.data])
 
-    
-    def recConcatenate(self, findFunc=lambda trackname, trackindex: [], fade=False):
-        if not(self.isMergable()):
-            return None
+    def isSequence(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        # nothing has to be composited for a merge: no fades, no linked tracks, no resizing
+        if fade:
+            return False
 
-        if self.empty():
-            return None
+        for i in range(0, len(self.data)):
+            if findFunc(self, i):
+                return False
+
+        if self.size:
+            for clip in filter(isVideoClip, self.data):
+                if tuple(clip.size) != tuple(self.size):
+                    return False
+        return True
 
+    def isStreamCopyable(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        # a merge can skip moviepy entirely if it only joins untouched files that ffmpeg can join as they are
+        return self.isSequence(findFunc, fade=fade) and canStreamCopy(self.data)
+
+    def editList(self):
+        return joinEditLists(*[getEditList(clip) for clip in self.data])
+
+    def isSmartRenderable(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        # cut up files can skip moviepy as well. Only the frames around the cuts are reencoded
+        return self.isSequence(findFunc, fade=fade) and canSmartRender(self.editList())
+    
+    def mergeKey(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        # everything a merge depends on: the clips, fades and size of this track, and the clips, offsets and audio factors of linked tracks
+        children = [[(child.getOffset(), child.getParentAudioFactor(), child.isAudioOnly(), child.data) for child in findFunc(self, i)] for i in range(0, len(self.data))]
+        return clipHash(("merge", "crossfade" if fade else False, self.fadeDuration, self.size, self.data, children, getRenderProfile(), duckAttack, duckRelease))
+
+    def recConcatenate(self, findFunc=lambda trackname, trackindex: [], fade=False, cache=None):
+        key = None
+        if cache is not None:
+            key = self.mergeKey(findFunc, fade=fade)
+            clip = cache.checkout(key)
+            if clip is not None:
+                return clip
+
+        clip = self._recConcatenate(findFunc, fade=fade)
+        if (clip is not None) and (key is not None):
+            setRenderKey(clip, key)
+            if isUnmodifiedFileClip(clip):
+                # stream copies are rendered already
+                cache.store(key, getFilepath(clip))
+        return clip
+    
+    def layout(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        # where everything plays in a merge of this track: (starts, fadeDuration, aclips, vclips, sequence, overlays, suppressions), with the start of each clip of the track, the sounds to mix, linked video clips, the track's own video clips, overlays and suppressions for the mixer
         # we accumulate this tracks clips and child clips, setting start position according to offsets of subtracks. We do it like this because recursive calls to CompositeVideoClip etc are very inefficient
-        (aclips, vclips) = ([], [])
-        curStart = 0
+        (aclips, vclips, sequence) = ([], [], [])
         overlays = []
         suppressions = []
-        if fade:
-            print("fade:" + str(self.fadeDuration))
-            fadeOut = lambda c, self=self: c.fadeout(self.fadeDuration) if isVideoClip(c) else c.audio_fadeout(self.fadeDuration)
-            fadeIn = lambda c, self=self: c.fadein(self.fadeDuration) if isVideoClip(c) else c.audio_fadeout(self.fadeDuration)
-        else:
-            fadeIn = lambda x: x
-            fadeOut = lambda x: x 
-            
+        # with fades, each clip overlaps the one before, and the two crossfade
+        durations = [clip.duration for clip in self.data]
+        (starts, fadeDuration) = crossfadeStarts(durations, self.fadeDuration if fade else 0)
+        envelopes = crossfadeEnvelopes(durations, fadeDuration)
 
         for i in range(0, len(self.data)):
-            isFirst = i == 0
-            isLast = i == len(self.data) - 1
-            
+            curStart = starts[i]
+            # fades are gain envelopes in the mix, rather than another fx layer on the clip
             if isAudioClip(self.data[i]):
-                aclips.append(self.data[i].with_start(curStart))
-                if isFirst:
-                    aclips[-1] = fadeOut(aclips[-1])
-                elif isLast:
-                    aclips[-1] = fadeIn(aclips[-1])
-                else:
-                    aclips[-1] = fadeIn(fadeOut(aclips[-1])) 
+                aclips.append((self.data[i].with_start(curStart), envelopes[i]))
             else:
-                print("video fade")
-                vclips.append(self.data[i].with_start(curStart))
-                if isFirst:
-                    vclips[-1] = fadeOut(vclips[-1])
-                    vclips[-1].audio = fadeOut(vclips[-1].audio)                    
-                elif isLast:
-                    print("last: " + str(i))
-                    vclips[-1] = fadeIn(vclips[-1])
-                    vclips[-1].audio = fadeIn(vclips[-1].audio)                    
-                else:
-                    vclips[-1] = fadeIn(fadeOut(vclips[-1]))                 
-                    vclips[-1].audio = fadeIn(fadeOut(vclips[-1].audio))                 
+                sequence.append(self.data[i])
+                if self.data[i].audio is not None:
+                    aclips.append((self.data[i].audio.with_start(curStart), envelopes[i]))
                 
             children = findFunc(self, i)
             for childTrack in children:
                 factor = childTrack.getParentAudioFactor()
-                #print("childtrack " + childTrack.name[:5])
-                #print("child fps " + str(childTrack.data[0].fps))                
-                #print("factor " + str(factor))
-                #print("offset " + str(childTrack.getOffset()))
-                #print("duration " + str(childTrack.getDuration()))
                 childstart = curStart+childTrack.getOffset()
                 childend = curStart+childTrack.getOffset()+childTrack.getDuration()
-                #print(str(childstart))
-                #print(str(childend))                
                 if not(factor is None):
                     #FIXME: assumming audio only
                     overlays += [clip.with_start(childstart) for clip in childTrack.data]
@@ -452,31 +521,56 @@ class Track(object):
                     aclips += [clip.with_start(childstart) for clip in childTrack.data]
                 else:
                     vclips += [clip.with_start(childstart) for clip in childTrack.data]
-                    
 
-            curStart += self.data[i].duration
+        return (starts, fadeDuration, aclips, vclips, sequence, overlays, suppressions)
+
+    def mixedAudio(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        """Returns (clip, starts): the sound of a merge of this track, mixed as it is played rather than rendered, and the start of each clip of the track in it."""
+        (starts, fadeDuration, aclips, vclips, sequence, overlays, suppressions) = self.layout(findFunc, fade=fade)
+        sounds = aclips + [clip.audio for clip in vclips if clip.audio is not None]
+        return (MixedAudioClip(sounds, suppressions=suppressions, overlays=overlays), starts)
+
+    def _recConcatenate(self, findFunc=lambda trackname, trackindex: [], fade=False):
+        if not(self.isMergable()):
+            return None
+
+        if self.empty():
+            return None
+
+        if self.isStreamCopyable(findFunc, fade=fade):
+            clip = ffmpeg_concat(self.data)
+            if clip is not None:
+                return clip
+            printerr("warning in Track.recConcatenate: ffmpeg failed to join clips. Falling back to reencoding.")
+        elif self.isSmartRenderable(findFunc, fade=fade):
+            clip = smartEditListClip(self.editList(), audio_bitrate=self.audio_bitrate)
+            if clip is not None:
+                return clip
+            printerr("warning in Track.recConcatenate: smart rendering failed. Falling back to reencoding.")
+
+        (starts, fadeDuration, aclips, vclips, sequence, overlays, suppressions) = self.layout(findFunc, fade=fade)
 
         if self.isAudioOnly():
-            return CompositeAudioClip(aclips + [clip.audio for clip in vclips])
+            # only mixes the clips that play at any given time, instead of asking all of them
+            return MixedAudioClip(aclips + [clip.audio for clip in vclips], suppressions=suppressions, overlays=overlays)
 
                 
         # video track
 
         # size of clips
-        if self.size:
-            # we just brutalize the clips, if you want to preserve aspect ratio, the user has to resize them manually before
-            resized_vclips = [clip.resize(new_size=self.size) for clip in vclips]
-    
-
-        video = CompositeVideoClip(resized_vclips)
-        audio = CompositeAudioClip([video.audio] + aclips)
-        for (factor, start, end) in suppressions:
-            video = video.multiply_volume(factor, start_time=start, end_time=end)
-            audio = audio.multiply_volume(factor, start_time=start, end_time=end)
-
-        audio = CompositeAudioClip([audio] + overlays)
-        video.audio = audio
-        print("video fps " + str(video.fps))
+        size = self.size or sequence[0].size
+        # we just brutalize the clips, if you want to preserve aspect ratio, the user has to resize them manually before
+        resize = lambda clip: clip if tuple(clip.size) == tuple(size) else clip.resize(new_size=size)
+        (sequence, vclips) = ([resize(clip) for clip in sequence], [resize(clip) for clip in vclips])
+
+        # the track's own clips just play one after another. Only linked video tracks have to be composited on top
+        video = SequenceVideoClip(sequence, fade=fadeDuration)
+        if vclips:
+            video = CompositeVideoClip([video] + vclips)
+        # all suppressions end up in one gain envelope, instead of one volume fx layer each
+        sounds = aclips + [clip.audio for clip in vclips if clip.audio is not None]
+        if sounds + overlays:
+            video.audio = MixedAudioClip(sounds, suppressions=suppressions, overlays=overlays)
         return video
 
     
@@ -486,32 +580,26 @@ class Track(object):
         
         if self.empty():
             return None
-            
+
+        if self.isStreamCopyable(fade=fade):
+            resultClip = ffmpeg_concat(self.data)
+            if resultClip is not None:
+                return resultClip
+        elif self.isSmartRenderable(fade=fade):
+            resultClip = smartEditListClip(self.editList(), audio_bitrate=self.audio_bitrate)
+            if resultClip is not None:
+                return resultClip
         
+        if fade:
+            # crossfades are laid out like in merges
+            return self._recConcatenate(fade=True)
+
         # quick job for audio tracks
         if self.isAudioOnly():
             resultClip = concatenate_audioclips(self.data)
-        elif fade:
-            # FIXME: no reason this shouldn't in principle work with audio only clips (except wonky library design in moviepy)
-            t = self.fadeDuration
-            c1 = self.data[0]
-            c1.audio = c1.audio.audio_fadeout(t)
-            c1 = c1.fadeout(t)
-            acc = [c1]
-            for clip in self.data[1:]:
-#                acc.append(clip)#.crossfadein(2))
-                cx = clip
-                cx.audio = cx.audio.audio_fadein(t)
-                cx.audio = cx.audio.audio_fadeout(t)
-                cx = cx.fadein(t)
-                cx = cx.fadeout(t)
-                acc.append(cx)
-                
-            #            tmp = concatenate(acc, padding=-2,method="compose")
-            resultClip = concatenate_videoclips(acc)
         else:
             resultClip = concatenate_videoclips(self.data)
-
+        return resultClip
 
 
     def clone(self):
@@ -519,7 +607,11 @@ class Track(object):
         n.unlock()
         n.data = []
         for clip in self.data:
-            n.data.append(clip.subclip(0))
+            if hasEditList(clip):
+                # keep the copy flat
+                n.data.append(makeEditListClip([seg.copy() for seg in getEditList(clip)]))
+            else:
+                n.data.append(clip.subclip(0))
         return n
 
             
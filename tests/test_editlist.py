@@ -0,0 +1,33 @@
+import numpy as np
+from tanto.clip import Segment, editListFade, editListGain, editListSlice, makeEditListAudioClip
+from tanto.synth import ToneClip
+
+def fadedTone():
+    tone = ToneClip(10, frequency=440, fps=8000)
+    segments = editListFade([Segment(tone, 0, 10)], 2, direction="in")
+    return editListFade(segments, 2, direction="out")
+
+def samples(segments):
+    return makeEditListAudioClip(segments, fps=8000).get_frame(np.arange(0, 10, 1 / 8000))
+
+def test_split_inside_fades_keeps_samples():
+    segments = fadedTone()
+    for t in [0.5, 1.9, 8.6, 9.4]:
+        pieces = editListSlice(segments, 0, t) + editListSlice(segments, t, 10)
+        assert len(pieces) == 2
+        assert np.allclose(samples(pieces), samples(segments))
+
+def test_gain_inside_fade_out_keeps_the_fade():
+    segments = fadedTone()
+    before = samples(segments)
+    assert np.allclose(samples(editListGain(segments, 8.6, 9.4, 1.0)), before)
+
+    after = samples(editListGain(segments, 8.6, 9.4, 0.5))
+    t = np.arange(0, 10, 1 / 8000)
+    middle = (t >= 8.6) & (t < 9.4)
+    assert np.allclose(after[middle], before[middle] * 0.5)
+    assert np.allclose(after[~middle], before[~middle])
+
+def test_pieces_of_one_fade_join_again():
+    segments = fadedTone()
+    assert len(editListGain(segments, 8.6, 9.4, 1.0)) == 1